@@ -2,6 +2,10 @@ import subprocess
 import tempfile
 import shutil
 import shlex
+import hashlib
+import json
+import tarfile
+import time
 import yaml
 import os
 import glob
@@ -9,11 +13,34 @@ import logging
 from string import Formatter
 
 ADDONS_FILE_PATH = os.path.join(os.path.dirname(__file__), "addons.yaml")
-FNULL = open(os.devnull, "w")
+FNULL = subprocess.DEVNULL
+
+# Bump this whenever the layout of the cached bundles changes, so stale
+# entries from an older juju-crashdump are never pushed to the units.
+CACHE_VERSION = 1
+CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "juju-crashdump",
+    "addons",
+)
+CACHE_MAX_ENTRIES = 16
+CACHE_MAX_AGE = 7 * 24 * 60 * 60  # a week, in seconds
+
+PUSH_MODES = ("direct", "controller", "zone")
+FANOUT = 4
+SSH_OPTIONS = " -o StrictHostKeyChecking=no"
 
 
 def do_addons(
-    addons_file_path, enabled_addons, machines, units, dump_to, uniq, as_root
+    addons_file_path,
+    enabled_addons,
+    machines,
+    units,
+    dump_to,
+    uniq,
+    as_root,
+    cache=None,
+    distribution=None,
 ):
     push_location = "/{dump_to}/{uniq}/addons".format(dump_to=dump_to, uniq=uniq)
     pull_location = "/{dump_to}/{uniq}/addon_output".format(dump_to=dump_to, uniq=uniq)
@@ -21,7 +48,9 @@ def do_addons(
     machines = [{"machine": m} for m in machines]
     units = [{"unit": u} for u in units]
     for addon_file in addons_file_path:
-        addons.update(load_addons(addon_file, enabled_addons, as_root))
+        addons.update(
+            load_addons(addon_file, enabled_addons, as_root, cache, distribution)
+        )
     async_commands('juju ssh --proxy {machine} "mkdir -p %s"' % push_location, machines)
     async_commands('juju ssh --proxy {machine} "mkdir -p %s"' % pull_location, machines)
     for addon in enabled_addons:
@@ -47,7 +76,9 @@ def tempdir(func):
     return temp_function
 
 
-def load_addons(addons_file_path, enabled_addons, as_root):
+def load_addons(
+    addons_file_path, enabled_addons, as_root, cache=None, distribution=None
+):
     with open(addons_file_path) as addons_file:
         addon_specs = yaml.safe_load(addons_file)
     addons = {}
@@ -62,12 +93,14 @@ def load_addons(addons_file_path, enabled_addons, as_root):
             logging.warn("The as_root flag must be used to run addon %s" % name)
             enabled_addons.remove(name)
             continue
-        addons[name] = CrashdumpAddon(name, info)
+        addons[name] = CrashdumpAddon(name, info, cache, distribution)
     return addons
 
 
 def async_commands(command, contexts, timeout=45, shell=False):
-    """Run the command concurrently for each given context."""
+    """Run the command concurrently for each given context.
+
+    Returns the contexts for which the command failed."""
     procs = []
     for context in contexts:
         args = ("timeout %ds " % timeout) + command.format(**context)
@@ -80,23 +113,256 @@ def async_commands(command, contexts, timeout=45, shell=False):
                     args, stdin=FNULL, stdout=FNULL, stderr=FNULL, shell=shell
                 ),
                 args,
+                context,
             ]
         )
         # The juju controller will only allow 10 connections at once
         if len(procs) > 9:
             procs[-10][0].communicate()
+    failed = []
     for proc in procs:
         proc[0].communicate()
         if proc[0].returncode != 0:
             logging.warning("command %s failed" % proc[1])
+            failed.append(proc[2])
+    return failed
+
+
+def plan_wave(holders, pending, fanout=FANOUT):
+    """Pair machines holding a payload with machines still waiting for it.
+
+    holders and pending are lists of contexts, a context only receives the
+    payload from a holder in the same "zone". Each holder relays to at most
+    fanout machines per wave, so repeating this for the machines which just
+    received the payload builds a tree. The paired contexts are removed from
+    pending, and the list of {"src": holder, "dst": machine} is returned.
+    """
+    wave = []
+    for holder in holders:
+        children = [c for c in pending if c.get("zone") == holder.get("zone")]
+        for child in children[:fanout]:
+            pending.remove(child)
+            wave.append({"src": holder, "dst": child})
+    return wave
+
+
+class PayloadDistribution(object):
+    """Pushes the payloads created by addon local commands to the machines.
+
+    In "direct" mode every machine gets its own upload from the local host.
+    In "controller" mode the payload is uploaded once to a controller
+    machine, and in "zone" mode once to a machine in each availability zone.
+    From there it is relayed machine to machine in a tree, so the upload
+    from the local host only happens once per relay point. Machines that
+    can't be reached through a relay fall back to a direct upload.
+    """
+
+    def __init__(
+        self,
+        mode="direct",
+        addresses=None,
+        zones=None,
+        controllers=None,
+        controller_model="controller",
+        fanout=FANOUT,
+    ):
+        if mode not in PUSH_MODES:
+            raise ValueError("Invalid push mode: %s" % mode)
+        self.mode = mode
+        self.addresses = addresses or {}
+        self.zones = zones or {}
+        # The controller machines, in controller_model.
+        self.controllers = controllers or []
+        self.controller_model = controller_model
+        self.fanout = fanout
+
+    def contexts(self, machines):
+        """Describe the machines we know how to relay to."""
+        contexts = []
+        for context in machines:
+            machine = context["machine"]
+            if machine not in self.addresses:
+                continue
+            contexts.append(
+                {
+                    "machine": machine,
+                    "model": "",
+                    "address": self.addresses[machine],
+                    "zone": self.zones.get(machine) if self.mode == "zone" else None,
+                }
+            )
+        return contexts
+
+    def seeds(self, pending):
+        if self.mode == "controller":
+            return [
+                {
+                    "machine": self.controllers[0],
+                    "model": "-m %s " % self.controller_model,
+                    "zone": None,
+                }
+            ]
+        seeds = []
+        for context in pending[:]:
+            if context["zone"] not in [s["zone"] for s in seeds]:
+                pending.remove(context)
+                seeds.append(context)
+        return seeds
+
+    def push(self, bundle, remote_bundle, machines):
+        pending = self.contexts(machines)
+        if self.mode == "direct" or not pending or (
+            self.mode == "controller" and not self.controllers
+        ):
+            return self.push_direct(bundle, remote_bundle, machines)
+        direct = [m for m in machines if m["machine"] not in self.addresses]
+        seeds = self.seeds(pending)
+        if self.mode == "controller":
+            async_commands(
+                'juju ssh {model}--proxy {machine} "mkdir -p %s"'
+                % os.path.dirname(remote_bundle),
+                seeds,
+            )
+        failed = async_commands(
+            "juju scp {model}--proxy -- %s {machine}:%s" % (bundle, remote_bundle),
+            seeds,
+        )
+        holders = [s for s in seeds if s not in failed]
+        # A failed controller upload leaves its subtree in pending.
+        direct.extend([s for s in failed if not s["model"]])
+        while pending and holders:
+            wave = plan_wave(holders, pending, self.fanout)
+            if not wave:
+                break
+            failed = async_commands(
+                "juju ssh {src[model]}--proxy {src[machine]} -- -A "
+                '"scp%s %s ubuntu@{dst[address]}:%s"'
+                % (SSH_OPTIONS, remote_bundle, remote_bundle),
+                wave,
+            )
+            holders = [w["dst"] for w in wave if w not in failed]
+            direct.extend([w["dst"] for w in failed])
+        direct.extend(pending)
+        if self.mode == "controller":
+            # Remove the directories created for the bundle as well, unless
+            # the controller is also being collected and they hold more.
+            location = os.path.dirname(remote_bundle)
+            async_commands(
+                'juju ssh {model}--proxy {machine} "rm -f %s; rmdir %s %s 2>/dev/null; '
+                'true"' % (remote_bundle, location, os.path.dirname(location)),
+                seeds,
+            )
+        if direct:
+            logging.info("Pushing %s directly to %d machines" % (bundle, len(direct)))
+            self.push_direct(bundle, remote_bundle, direct)
+
+    def push_direct(self, bundle, remote_bundle, machines):
+        async_commands(
+            "juju scp --proxy -- %s {machine}:%s" % (bundle, remote_bundle),
+            [{"machine": m["machine"]} for m in machines],
+        )
+
+
+class ArtifactCache(object):
+    """A persistent cache of the bundles produced by addon local steps.
+
+    Entries are keyed by the addon name, its local command and CACHE_VERSION,
+    so editing an addon definition never reuses an old bundle. The least
+    recently used entries are evicted once there are more than max_entries.
+    Entries older than max_age seconds are rebuilt, and only reused if that
+    fails, e.g. without network access.
+    """
+
+    def __init__(
+        self, path=CACHE_DIR, max_entries=CACHE_MAX_ENTRIES, max_age=CACHE_MAX_AGE
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+
+    def key(self, name, command):
+        definition = json.dumps([CACHE_VERSION, name, command])
+        return hashlib.sha256(definition.encode("utf-8")).hexdigest()
+
+    def bundle_path(self, name, command):
+        return os.path.join(self.path, "%s.tar.gz" % self.key(name, command))
+
+    def get(self, name, command):
+        """Return the cached bundle for this addon, or None on a miss."""
+        bundle = self.bundle_path(name, command)
+        try:
+            age = time.time() - os.path.getmtime(bundle)
+        except OSError:
+            return None
+        if age > self.max_age:
+            logging.debug("Cached bundle %s for %s expired" % (bundle, name))
+            return None
+        # The mtime doubles as the last use time for the LRU eviction.
+        os.utime(bundle, None)
+        logging.debug("Using cached bundle %s for %s" % (bundle, name))
+        return bundle
+
+    def get_expired(self, name, command):
+        """Return the cached bundle for this addon even if it expired, or None.
+        It is replaced once a rebuild succeeds."""
+        bundle = self.bundle_path(name, command)
+        if not os.path.exists(bundle):
+            return None
+        os.utime(bundle, None)
+        return bundle
+
+    def put(self, name, command, bundle):
+        """Move a freshly built bundle into the cache and return its path."""
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        cached = self.bundle_path(name, command)
+        shutil.move(bundle, cached + ".partial")
+        os.rename(cached + ".partial", cached)
+        self.evict()
+        return cached
+
+    def evict(self):
+        bundles = sorted(
+            glob.glob(os.path.join(self.path, "*.tar.gz")),
+            key=os.path.getmtime,
+            reverse=True,
+        )
+        for bundle in bundles[self.max_entries:]:
+            logging.debug("Evicting cached bundle %s" % bundle)
+            os.remove(bundle)
+
+
+def build_bundle(command, bundle):
+    """Run command in a scratch directory and tar up everything it creates.
+
+    Returns False if the command failed, in which case no bundle is written.
+    """
+    olddir = os.getcwd()
+    workdir = tempfile.mkdtemp()
+    os.chdir(workdir)
+    try:
+        logging.debug("Running %s" % command)
+        subprocess.check_call(command, shell=True, stdout=FNULL, stderr=FNULL)
+        with tarfile.open(bundle, "w:gz") as tar:
+            for name in sorted(os.listdir(".")):
+                tar.add(name)
+    except subprocess.CalledProcessError as e:
+        logging.warn("Command %s failed with \n %s" % (command, e))
+        return False
+    finally:
+        os.chdir(olddir)
+        shutil.rmtree(workdir)
+    return True
 
 
 class CrashdumpAddon(object):
     """An addon to run on the nodes"""
 
-    def __init__(self, name, info={}):
+    def __init__(self, name, info={}, cache=None, distribution=None):
         self.name = name
         self.info = info
+        self.cache = cache
+        self.distribution = distribution or PayloadDistribution()
 
     def run(self, *args):
         for action, command in self.info.items():
@@ -109,18 +375,49 @@ class CrashdumpAddon(object):
 
     def local(self, command, machines, units, context):
         """This will fetch the command, and push it to the machines"""
+        bundle_dir = tempfile.mkdtemp()
         try:
-            logging.debug("Running %s" % command)
-            subprocess.check_call(command, shell=True, stdout=FNULL, stderr=FNULL)
-        except subprocess.CalledProcessError as e:
-            logging.warn("Command %s failed with \n %s" % (command, e))
-            return False
-        files = " ".join(glob.glob("*"))
+            bundle = os.path.join(bundle_dir, "%s.tar.gz" % self.name)
+            if not build_bundle(command, bundle):
+                return False
+            self.push_bundle(bundle, machines, context)
+        finally:
+            shutil.rmtree(bundle_dir)
+        return True
+
+    def local_cached(self, command, machines, units, context):
+        """Like local, but reuse the files from an earlier run if cached"""
+        if self.cache is None:
+            return self.local(command, machines, units, context)
+        bundle = self.cache.get(self.name, command)
+        if bundle is None:
+            bundle_dir = tempfile.mkdtemp()
+            try:
+                bundle = os.path.join(bundle_dir, "%s.tar.gz" % self.name)
+                if build_bundle(command, bundle):
+                    bundle = self.cache.put(self.name, command, bundle)
+                else:
+                    bundle = self.cache.get_expired(self.name, command)
+                    if bundle is None:
+                        return False
+                    logging.warning(
+                        "Rebuilding %s failed, using the expired cached bundle %s"
+                        % (self.name, bundle)
+                    )
+            finally:
+                shutil.rmtree(bundle_dir)
+        self.push_bundle(bundle, machines, context)
+        return True
+
+    def push_bundle(self, bundle, machines, context):
+        """Push a single compressed bundle to the machines and unpack it there"""
+        remote_bundle = "%s/%s.tar.gz" % (context["location"], self.name)
+        self.distribution.push(bundle, remote_bundle, machines)
         async_commands(
-            "juju scp --proxy -- -r  %s {machine}:%s" % (files, context["location"]),
+            'juju ssh --proxy {machine} "tar -xzf %s -C %s; rm -f %s"'
+            % (remote_bundle, context["location"], remote_bundle),
             machines,
         )
-        return True
 
     def local_per_unit(self, cmd, machines, units, context):
         # Check if {unit} or {machine} is used and update the command to push to the
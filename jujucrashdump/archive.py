@@ -0,0 +1,265 @@
+"""An indexed crashdump archive format, and the `inspect` subcommand.
+
+Unlike a compressed tarball, single files can be read from it without
+decompressing everything before them. The layout is:
+
+    MAGIC, followed by the codec name padded to 4 bytes
+    the compressed chunks of every file, each compressed independently
+    the compressed JSON index
+    TRAILER: the offset and length of the index, followed by INDEX_MAGIC
+
+The index is a list of entries describing each file, directory or symlink,
+in the order they were written:
+
+    {"path": "<uniq>/0/baremetal/var/log/syslog", "type": "file",
+     "mode": 420, "mtime": 1676052966, "size": 4242,
+     "chunks": [[<offset>, <compressed length>], ...]}
+    {"path": "<uniq>/nova-compute_3", "type": "symlink", "target": "0/baremetal"}
+"""
+
+import argparse
+import fnmatch
+import json
+import lzma
+import os
+import re
+import stat
+import struct
+import sys
+import zlib
+
+MAGIC = b"JCDUMP01"
+INDEX_MAGIC = b"JCDINDEX"
+TRAILER = struct.Struct(">QQ8s")
+CHUNK_SIZE = 4 * 1024 * 1024
+CODECS = {
+    "xz": (lzma.compress, lzma.decompress),
+    "gz": (zlib.compress, zlib.decompress),
+}
+EXTENSION = "jcd"
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def write_archive(src, path, codec="xz"):
+    """Write the contents of the directory src to an indexed archive at path.
+
+    Paths in the archive are relative to src, the archive itself is skipped
+    if it is inside src.
+    """
+    compress = CODECS[codec][0]
+    index = {"entries": []}
+    skip = os.path.abspath(path)
+    with open(path, "wb") as out:
+        out.write(MAGIC + codec.encode("ascii").ljust(4))
+        for root, dirs, files in os.walk(src):
+            dirs.sort()
+            for name in sorted(dirs) + sorted(files):
+                full = os.path.join(root, name)
+                if os.path.abspath(full) == skip:
+                    continue
+                st = os.lstat(full)
+                entry = {
+                    "path": os.path.relpath(full, src),
+                    "mode": stat.S_IMODE(st.st_mode),
+                    "mtime": int(st.st_mtime),
+                }
+                if stat.S_ISLNK(st.st_mode):
+                    entry.update(type="symlink", target=os.readlink(full))
+                elif stat.S_ISDIR(st.st_mode):
+                    entry["type"] = "dir"
+                elif stat.S_ISREG(st.st_mode):
+                    entry.update(type="file", size=0, chunks=[])
+                    with open(full, "rb") as fd:
+                        for data in iter(lambda: fd.read(CHUNK_SIZE), b""):
+                            data = compress(data)
+                            entry["chunks"].append([out.tell(), len(data)])
+                            out.write(data)
+                    entry["size"] = st.st_size
+                else:
+                    # Sockets, fifos and devices carry no data worth keeping.
+                    continue
+                index["entries"].append(entry)
+        data = compress(json.dumps(index).encode("utf-8"))
+        offset = out.tell()
+        out.write(data)
+        out.write(TRAILER.pack(offset, len(data), INDEX_MAGIC))
+
+
+def is_archive(path):
+    with open(path, "rb") as fd:
+        return fd.read(len(MAGIC)) == MAGIC
+
+
+class IndexedArchive(object):
+    """Random access to the files in an indexed archive."""
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = open(path, "rb")
+        if self.fd.read(len(MAGIC)) != MAGIC:
+            raise ArchiveError("%s is not an indexed crashdump archive" % path)
+        codec = self.fd.read(4).decode("ascii").strip()
+        if codec not in CODECS:
+            raise ArchiveError("%s uses an unknown codec %s" % (path, codec))
+        self.decompress = CODECS[codec][1]
+        self.fd.seek(-TRAILER.size, os.SEEK_END)
+        offset, length, magic = TRAILER.unpack(self.fd.read(TRAILER.size))
+        if magic != INDEX_MAGIC:
+            raise ArchiveError("%s is truncated, the index is missing" % path)
+        self.fd.seek(offset)
+        index = json.loads(self.decompress(self.fd.read(length)).decode("utf-8"))
+        self.entries = {entry["path"]: entry for entry in index["entries"]}
+
+    def close(self):
+        self.fd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def names(self, pattern=None):
+        """List the paths in the archive, optionally matching a glob."""
+        return [
+            name
+            for name in self.entries
+            if pattern is None or fnmatch.fnmatch(name, pattern)
+        ]
+
+    def resolve(self, path):
+        """Return the entry for path, following symlinks in any component."""
+        parts = path.strip("/").split("/")
+        resolved = []
+        for _ in range(40):
+            while parts:
+                resolved.append(parts.pop(0))
+                entry = self.entries.get("/".join(resolved))
+                if entry is None:
+                    raise KeyError(path)
+                if entry["type"] == "symlink":
+                    resolved.pop()
+                    target = os.path.normpath(
+                        os.path.join("/".join(resolved), entry["target"])
+                    )
+                    parts = target.split("/") + parts
+                    resolved = []
+                    break
+            else:
+                return entry
+        raise ArchiveError("Too many levels of symbolic links: %s" % path)
+
+    def chunks(self, path):
+        """Yield the decompressed contents of a file in the archive."""
+        entry = self.resolve(path)
+        if entry["type"] != "file":
+            raise ArchiveError("%s is not a file" % path)
+        for offset, length in entry["chunks"]:
+            self.fd.seek(offset)
+            yield self.decompress(self.fd.read(length))
+
+    def read(self, path):
+        return b"".join(self.chunks(path))
+
+    def lines(self, path):
+        """Yield the lines of a file in the archive."""
+        return split_lines(self.chunks(path))
+
+
+def split_lines(chunks):
+    """Yield the lines of the data in chunks."""
+    rest = b""
+    for data in chunks:
+        lines = (rest + data).split(b"\n")
+        rest = lines.pop()
+        for line in lines:
+            yield line + b"\n"
+    if rest:
+        yield rest
+
+
+def grep(archive, pattern, names):
+    """Yield (path, line number, line) for lines matching the regex."""
+    regex = re.compile(pattern.encode("utf-8"))
+    for name in names:
+        if archive.entries[name]["type"] != "file":
+            continue
+        for number, line in enumerate(archive.lines(name), 1):
+            if regex.search(line):
+                yield name, number, line
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="juju-crashdump inspect",
+        description="Read files from an indexed crashdump archive without "
+        "extracting it.",
+    )
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+    list_parser = commands.add_parser("list", help="List the files in the archive")
+    list_parser.add_argument("archive")
+    list_parser.add_argument("glob", nargs="?", help="Only list matching paths")
+    list_parser.add_argument(
+        "-l", "--long", action="store_true", help="Show the type and size"
+    )
+    cat_parser = commands.add_parser("cat", help="Print files from the archive")
+    cat_parser.add_argument("archive")
+    cat_parser.add_argument("path", nargs="+")
+    grep_parser = commands.add_parser("grep", help="Search files in the archive")
+    grep_parser.add_argument("pattern", help="A python regular expression")
+    grep_parser.add_argument("archive")
+    grep_parser.add_argument(
+        "glob", nargs="*", help="Only search matching paths (default: all)"
+    )
+    return parser.parse_args(argv)
+
+
+def inspect(opts, out):
+    with IndexedArchive(opts.archive) as archive:
+        if opts.command == "list":
+            for name in archive.names(opts.glob):
+                if opts.long:
+                    entry = archive.entries[name]
+                    detail = entry.get("size", entry.get("target", ""))
+                    out.write(
+                        ("%-7s %12s %s\n" % (entry["type"], detail, name)).encode()
+                    )
+                else:
+                    out.write(("%s\n" % name).encode())
+        elif opts.command == "cat":
+            for path in opts.path:
+                for data in archive.chunks(path):
+                    out.write(data)
+        elif opts.command == "grep":
+            names = [
+                name
+                for name in archive.names()
+                if any(fnmatch.fnmatch(name, p) for p in opts.glob or ["*"])
+            ]
+            for name, number, line in grep(archive, opts.pattern, names):
+                out.write(("%s:%d:" % (name, number)).encode() + line)
+
+
+def fail(prog, message):
+    """Report a user error of the subcommand prog and exit."""
+    sys.stderr.write("%s: %s\n" % (prog, message))
+    sys.exit(1)
+
+
+def main(argv=None):
+    opts = parse_args(argv)
+    out = sys.stdout.buffer
+    try:
+        inspect(opts, out)
+    except KeyError as e:
+        fail("juju-crashdump inspect", "%s: no such file in the archive" % e.args[0])
+    except re.error as e:
+        fail("juju-crashdump inspect", "invalid pattern %r: %s" % (opts.pattern, e))
+    except (ArchiveError, FileNotFoundError) as e:
+        fail("juju-crashdump inspect", e)
+    finally:
+        out.flush()
@@ -1,14 +1,20 @@
 #!/usr/bin/env python3
 
-# you also might need to $ sudo apt install python-apport
+# you also might need to $ sudo apt install python3-launchpadlib
 
 import argparse
+import gzip
+import json
 import multiprocessing
 import os
+import re
 import shutil
+import signal
 import subprocess
 import sys
+import tarfile
 import tempfile
+import time
 import uuid
 import yaml
 import concurrent.futures
@@ -17,18 +23,18 @@ import ssh_agent_setup
 
 from collections import defaultdict
 from os.path import expanduser
-
-try:
-    import apport
-    import apport.crashdb
-    import apport.hookutils
-
-    APPORT = True
-except ImportError:
-    APPORT = False
-
-from textwrap import dedent
-from jujucrashdump.addons import ADDONS_FILE_PATH, do_addons, FNULL
+from jujucrashdump.addons import (
+    ADDONS_FILE_PATH,
+    ArtifactCache,
+    CACHE_DIR,
+    do_addons,
+    FANOUT,
+    FNULL,
+    PayloadDistribution,
+    PUSH_MODES,
+)
+from jujucrashdump import archive, redact, retry, search, timeline, triage, upload
+from jujucrashdump.debuglog import collect_debuglog
 
 
 MAX_FILE_SIZE = 5000000  # 5MB max for files
@@ -78,41 +84,157 @@ DIRECTORIES = [
     "/var/snap/lxd/common/lxd/logs/",
 ]
 
-SSH_PARM = " -o StrictHostKeyChecking=no"
+# Output captured with run_cmd(..., compress=True) passes through a buffer of
+# this size, uncompressed output is written to the file by the command itself.
+BUFFER_SIZE = 1024 * 1024
+# The size in bytes and duration in seconds of each capture made by run_cmd,
+# keyed by file name. Saved as capture_stats.yaml in the crashdump.
+CAPTURES = {}
+
+# Number of kubectl commands to run at once when collecting CaaS models.
+KUBECTL_JOBS = 8
+# Where on a unit its tarball is written when the unit dump location is
+# short on space, before falling back to streaming it over ssh.
+FALLBACK_DUMP_LOCATIONS = ["/var/tmp", "/home/ubuntu"]
+# Space in bytes to leave free on top of the estimated unit tarball size.
+DISK_HEADROOM = 256 * 1024 * 1024
+
+# Seconds ssh waits for a connection, well within --timeout, so an address
+# that drops packets fails with SSH_ERROR and the next one is tried.
+CONNECT_TIMEOUT = 10
+SSH_PARM = " -o StrictHostKeyChecking=no -o ConnectTimeout=%d" % CONNECT_TIMEOUT
 
 SSH_CMD = "ssh" + SSH_PARM
 SCP_CMD = "scp" + SSH_PARM
+# The exit status of ssh when it could not connect.
+SSH_ERROR = 255
+# The exit status of timeout when it killed the command.
+TIMEOUT_ERROR = 124
+
+
+def unit_tarball_routes(machine, ips, remote_tar, stream_cmd):
+    """Return the commands fetching the tarball of machine into "{output}",
+    one per route: over ssh to each of its addresses, then through the
+    controller with juju. With a stream_cmd there was no room for the
+    tarball on the unit, it is created by stream_cmd and streamed over ssh
+    instead."""
+    if stream_cmd is None:
+        routes = ["{} {}:{} {{output}}".format(SCP_CMD, ip, remote_tar) for ip in ips]
+        routes.append("juju scp --proxy {}:{} {{output}}".format(machine, remote_tar))
+    else:
+        routes = [
+            "{} {} '{}' > {{output}}".format(SSH_CMD, ip, stream_cmd) for ip in ips
+        ]
+        # No pty, it would mangle the binary tar stream.
+        routes.append(
+            "juju ssh --pty=false --proxy {} '{}' > {{output}}".format(
+                machine, stream_cmd
+            )
+        )
+    return routes
 
 
-def retrieve_single_unit_tarball(tuple_input):
-    unique, machine, alias_group, all_machines, unit_dump_location = tuple_input
-    unit_unique = uuid.uuid4()
-    for ip in all_machines[machine]:
-        if run_cmd(
-            "{scp} {ip}:{dump_location}/{unique}/juju-dump-{unique}.tar"
-            " {unit_unique}.tar".format(
-                scp=SCP_CMD,
-                ip=ip,
-                dump_location=unit_dump_location,
-                unique=unique,
-                unit_unique=unit_unique,
-            )
-        ):
-            break
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def fetch_unit_tarball(routes, output, stragglers, poll=1.0):
+    """Fetch a unit tarball into output over the first of routes, see
+    unit_tarball_routes. When a route fails the next one is tried, and when
+    it is a straggler the next one is started next to it and the first
+    attempt to finish wins. Return whether one did."""
+    start = time.time()
+    pending = list(enumerate(routes))
+    running = []
+
+    def launch():
+        n, route = pending.pop(0)
+        path = "%s.%d" % (output, n)
+        command = route.replace("{output}", path)
+        logging.debug("Calling {}".format(command))
+        proc = subprocess.Popen(
+            command,
+            shell=True,
+            stdin=FNULL,
+            stdout=FNULL,
+            stderr=FNULL,
+            start_new_session=True,
+        )
+        running.append((proc, path, command))
+
+    launch()
+    try:
+        while running:
+            time.sleep(poll)
+            for attempt in list(running):
+                proc, path, command = attempt
+                if proc.poll() is None:
+                    continue
+                running.remove(attempt)
+                if proc.returncode == 0:
+                    stragglers.finished(time.time() - start)
+                    os.rename(path, output)
+                    return True
+                logging.warning('Command "%s" failed' % command)
+                _remove(path)
+            if pending and (
+                not running
+                or (len(running) == 1 and stragglers.is_straggler(time.time() - start))
+            ):
+                if running:
+                    logging.info(
+                        'Command "%s" is slow, trying the next route too.'
+                        % running[0][2]
+                    )
+                launch()
+        return False
+    finally:
+        # The other attempts lost the race.
+        for proc, path, _ in running:
+            os.killpg(proc.pid, signal.SIGTERM)
+            proc.wait()
+            _remove(path)
+
+
+def machine_directory(machine):
+    # Where the tarball of a machine is extracted: 0/baremetal, 0/lxd/1, ...
     if "/" not in machine:
-        machine += "/baremetal"
-    run_cmd("mkdir -p %s || true" % machine)
+        return machine + "/baremetal"
+    return machine
+
+
+def extract_unit_tarball(tuple_input):
+    """Extract the tarball of a machine and link its aliases to it. Returns
+    (machine, state, findings), where state is "complete", "partial" if the
+    tarball could only be partly extracted, or "missing"."""
+    machine, alias_group, tarball, scan = tuple_input
+    directory = machine_directory(machine)
+    run_cmd("mkdir -p %s || true" % directory)
+    findings = None
     try:
-        run_cmd("tar -pxf %s.tar -C %s" % (unit_unique, machine))
-        run_cmd("rm %s.tar" % unit_unique)
-    except IOError:
-        # If you are running crashdump as a machine is coming
-        # up, or scp fails for some other reason, you won't
-        # have a tarball to move. In that case, skip, and try
-        # fetching the tarball for the next machine.
-        logging.warning("Unable to retrieve tarball for %s. Skipping." % machine)
+        if scan:
+            # Extract in python, so the triage sees the files as they go by.
+            findings = triage.extract_and_scan(tarball, directory, directory)
+            extracted = True
+        else:
+            extracted = run_cmd("tar -pxf %s -C %s" % (tarball, directory))
+    except (IOError, tarfile.TarError):
+        extracted = False
+    run_cmd("rm %s" % tarball)
+    if extracted:
+        state = "complete"
+    elif os.listdir(directory):
+        logging.warning("Unable to extract all of the tarball of %s." % machine)
+        state = "partial"
+    else:
+        logging.warning("Unable to extract the tarball of %s. Skipping." % machine)
+        return machine, "missing", findings
     for alias in alias_group:
-        os.symlink("%s" % machine, "%s" % alias.replace("/", "_"))
+        os.symlink("%s" % directory, "%s" % alias.replace("/", "_"))
+    return machine, state, findings
 
 
 def service_unit_addresses(status):
@@ -149,18 +271,46 @@ def service_unit_addresses(status):
     return out
 
 
+def machine_addresses(status):
+    """From a given juju_status.yaml dict return a mapping of
+    {'machine/container': ('<dns-name>', '<availability zone>')}.
+    Containers are placed in the availability zone of their host."""
+    out = {}
+    for m_id, m_info in status["machines"].items():
+        zone = None
+        for constraint in m_info.get("hardware", "").split():
+            if constraint.startswith("availability-zone="):
+                zone = constraint.split("=", 1)[1]
+        if "dns-name" in m_info:
+            out[m_id] = (m_info["dns-name"], zone)
+        for c_id, c_info in m_info.get("containers", {}).items():
+            if "dns-name" in c_info:
+                out[c_id] = (c_info["dns-name"], zone)
+    return out
+
+
 def set_model(model):
     os.environ["JUJU_ENV"] = model
     os.environ["JUJU_MODEL"] = model
 
 
-def run_cmd(command, fatal=False, to_file=None):
+def run_cmd(command, fatal=False, to_file=None, compress=False):
     logging.debug("Calling {}".format(command))
+    start = time.time()
     try:
-        output = subprocess.check_output(command, shell=True, stderr=FNULL)
-        if to_file is not None:
-            with open(to_file, "wb") as fd:
-                fd.write(output)
+        if to_file is None:
+            subprocess.check_call(command, shell=True, stdout=FNULL, stderr=FNULL)
+        else:
+            size = capture(command, to_file, compress)
+            CAPTURES[to_file] = {
+                "bytes": size,
+                "seconds": round(time.time() - start, 3),
+            }
+            logging.debug(
+                "Captured {} bytes to {} in {:.1f}s".format(
+                    size, to_file, time.time() - start
+                )
+            )
     except subprocess.CalledProcessError as e:
         logging.warning('Command "%s" failed' % command)
         logging.warning(e)
@@ -171,6 +321,32 @@ def run_cmd(command, fatal=False, to_file=None):
     return True
 
 
+def capture(command, to_file, compress=False):
+    """Stream the output of command into to_file, gzip compressed if asked,
+    and return the number of bytes it wrote to stdout. The file is removed
+    again if the command fails."""
+    try:
+        if not compress:
+            with open(to_file, "wb") as fd:
+                subprocess.check_call(command, shell=True, stdout=fd, stderr=FNULL)
+            return os.path.getsize(to_file)
+        size = 0
+        with gzip.open(to_file, "wb") as fd:
+            proc = subprocess.Popen(
+                command, shell=True, stdout=subprocess.PIPE, stderr=FNULL
+            )
+            for chunk in iter(lambda: proc.stdout.read(BUFFER_SIZE), b""):
+                fd.write(chunk)
+                size += len(chunk)
+            proc.stdout.close()
+            if proc.wait() != 0:
+                raise subprocess.CalledProcessError(proc.returncode, command)
+        return size
+    except subprocess.CalledProcessError:
+        os.remove(to_file)
+        raise
+
+
 def juju_cmd(command, *args, **kwargs):
     command_prefix = "juju "
     run_cmd(command_prefix + command, *args, **kwargs)
@@ -181,18 +357,23 @@ def juju_check():
     run_cmd("juju switch", fatal=True)
 
 
-def juju_status():
+def juju_status(controller_model="controller"):
     juju_cmd(" status --format=yaml", to_file="juju_status.yaml")
     juju_cmd(
-        " status -m controller --format=yaml", to_file="juju_status_controller.yaml"
+        " status -m %s --format=yaml" % controller_model,
+        to_file="juju_status_controller.yaml",
     )
     juju_cmd(
         " status --format=tabular --relations --storage", to_file="juju_status.txt"
     )
 
 
-def juju_debuglog():
-    juju_cmd("debug-log --date --replay --no-tail", to_file="debug_log.txt")
+def juju_debuglog(compress=False):
+    juju_cmd(
+        "debug-log --date --replay --no-tail",
+        to_file="debug_log.txt.gz" if compress else "debug_log.txt",
+        compress=compress,
+    )
 
 
 def juju_model_defaults():
@@ -207,14 +388,170 @@ def juju_storage_pools():
     juju_cmd("storage-pools --format=yaml", to_file="storage_pools.yaml")
 
 
-def run_ssh(host, timeout, ssh_cmd, cmd):
+def kubernetes_tasks(namespace, pods, since=None):
+    """From a given `kubectl get pods -o json` dict return a list of
+    (command, file) for the describe output and logs of each pod, including
+    the logs of the previous instance of containers that restarted."""
+    tasks = []
+    logs_cmd = "kubectl -n {} logs --timestamps".format(namespace)
+    if since:
+        logs_cmd += " --since={}".format(since)
+    for pod in pods["items"]:
+        name = pod["metadata"]["name"]
+        tasks.append(
+            (
+                "kubectl -n {} describe pod {}".format(namespace, name),
+                "kubernetes/{}/describe.txt".format(name),
+            )
+        )
+        restarts = {
+            c["name"]: c.get("restartCount", 0)
+            for c in pod.get("status", {}).get("containerStatuses", [])
+            + pod.get("status", {}).get("initContainerStatuses", [])
+        }
+        containers = pod["spec"].get("initContainers", []) + pod["spec"]["containers"]
+        for container in containers:
+            container = container["name"]
+            tasks.append(
+                (
+                    "{} {} -c {}".format(logs_cmd, name, container),
+                    "kubernetes/{}/{}.log".format(name, container),
+                )
+            )
+            if restarts.get(container):
+                tasks.append(
+                    (
+                        "{} {} -c {} --previous".format(logs_cmd, name, container),
+                        "kubernetes/{}/{}.previous.log".format(name, container),
+                    )
+                )
+    return tasks
+
+
+def collect_kubernetes(namespace, since=None, jobs=KUBECTL_JOBS, compress=False):
+    """Save the events, and the describe output and logs of all pods in
+    namespace to the kubernetes directory, running up to jobs kubectl
+    commands at once. The logs are gzip compressed if compress is set."""
+    if not os.path.isdir("kubernetes"):
+        os.mkdir("kubernetes")
+    run_cmd(
+        "kubectl -n {} get events --sort-by=.lastTimestamp".format(namespace),
+        to_file="kubernetes/events.txt",
+    )
+    if not run_cmd(
+        "kubectl -n {} get pods -o json".format(namespace),
+        to_file="kubernetes/pods.json",
+    ):
+        return
+    with open("kubernetes/pods.json") as fd:
+        pods = json.load(fd)
+    tasks = kubernetes_tasks(namespace, pods, since)
+    for pod in pods["items"]:
+        os.mkdir("kubernetes/{}".format(pod["metadata"]["name"]))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        for command, to_file in tasks:
+            if compress and to_file.endswith(".log"):
+                executor.submit(run_cmd, command, to_file=to_file + ".gz", compress=True)
+            else:
+                executor.submit(run_cmd, command, to_file=to_file)
+
+
+def reached(command):
+    """Run an ssh command, return False if it could not connect or timed
+    out, then the next address is worth trying."""
+    logging.debug("Calling {}".format(command))
+    code = subprocess.call(command, shell=True, stdout=FNULL, stderr=FNULL)
+    if code in (SSH_ERROR, TIMEOUT_ERROR):
+        logging.debug('Command "%s" could not connect' % command)
+        return False
+    if code != 0:
+        logging.warning('Command "%s" failed with exit status %d' % (command, code))
+    return True
+
+
+def run_ssh(host, timeout, ssh_cmd, cmd, policy=retry.SSH, budget=None):
     # Each host can have several interfaces and IP addresses.
-    # This cycles through them and uses the first working.
+    # This cycles through them and uses the first working, and retries
+    # as the policy and error budget allow if none is. Returns whether one
+    # was.
+    def attempt():
+        for ip in host:
+            if reached("timeout {}s {} {} '{}'".format(timeout, ssh_cmd, ip, cmd)):
+                return True
+        return False
+
+    return retry.retry(attempt, policy, budget, "ssh to %s" % " ".join(host))
+
+
+def run_scp(host, timeout, files, remote_dir, policy=retry.SSH, budget=None):
+    # Like run_ssh, push the files over the first working address.
+    def attempt():
+        for ip in host:
+            if run_cmd(
+                "timeout {}s {} {} {}:{}".format(
+                    timeout, SCP_CMD, " ".join(files), ip, remote_dir
+                )
+            ):
+                return True
+        return False
+
+    return retry.retry(attempt, policy, budget, "scp to %s" % " ".join(host))
+
+
+def setup_ssh_agent():
+    # Only done when collecting, the ssh-agent and ssh-add calls slow down
+    # --help, --description and the subcommands for nothing.
+    ssh_agent_setup.setup()
+    ssh_agent_setup.add_key(
+        os.path.join(os.path.expanduser("~"), ".local/share/juju/ssh/juju_id_rsa")
+    )
+
+
+def load_status(path):
+    """Load a juju status yaml file, with the C loader if PyYAML was built
+    with libyaml, as the status of a large model takes a while to parse."""
+    loader = getattr(yaml, "CFullLoader", yaml.FullLoader)
+    with open(path, "r") as fd:
+        return yaml.load(fd, Loader=loader)
+
+
+def run_ssh_output(host, timeout, ssh_cmd, cmd):
+    # Like run_ssh, but return the output of the first working address, or
+    # None if none worked.
     for ip in host:
-        if run_cmd("timeout {}s {} {} '{}'".format(timeout, ssh_cmd, ip, cmd)):
-            # If successful, no need to try the other hosts again
-            host = [ip]
-            break
+        try:
+            output = subprocess.check_output(
+                "timeout {}s {} {} '{}'".format(timeout, ssh_cmd, ip, cmd),
+                shell=True,
+                stderr=FNULL,
+            )
+        except subprocess.CalledProcessError:
+            continue
+        return output.decode("utf-8", "replace")
+    return None
+
+
+def parse_preflight(output):
+    """Parse the output of the pre-flight command of a unit into the
+    estimated size of its tarball and a mapping of {location: available}
+    of the space available at each candidate dump location, in bytes."""
+    lines = output.splitlines()
+    estimate = int(lines[0])
+    available = {}
+    for line in lines[1:]:
+        parts = line.split()
+        if len(parts) == 2 and parts[1].isdigit():
+            available[parts[0]] = int(parts[1]) * 1024
+    return estimate, available
+
+
+def choose_dump_location(estimate, available, locations):
+    """Return the first of locations with room for a tarball of the
+    estimated size, or None if there is none and it should be streamed."""
+    for location in locations:
+        if available.get(location, 0) >= estimate + DISK_HEADROOM:
+            return location
+    return None
 
 
 class CrashCollector(object):
@@ -235,15 +572,40 @@ class CrashCollector(object):
         journalctl=None,
         unit_dump_location="/tmp",
         as_root=False,
+        addons_cache=None,
+        addons_push="direct",
+        addons_push_fanout=FANOUT,
+        debug_log_jobs=1,
+        caas_log_since=None,
+        caas_jobs=KUBECTL_JOBS,
+        compress_captures=False,
+        archive_format="tar",
+        triage=False,
+        timeline=None,
+        redact=None,
+        keep_unit_dumps=False,
+        preflight=True,
+        fallback_dump_locations=None,
+        retries=None,
+        error_budget=retry.ERROR_BUDGET,
+        uploader=None,
+        workdir=None,
+        skip_machines=None,
     ):
         if model:
             set_model(model)
+        self.model = model
         self.max_size = max_size
         self.extra_dirs = extra_dirs
         self.cwd = os.getcwd()
         self.uniq = uniq or uuid.uuid4()
-        self.tempdir = tempfile.mkdtemp(dir=expanduser("~"))
-        self.tardir = os.path.join(self.tempdir, str(self.uniq))
+        if workdir is None:
+            self.tempdir = tempfile.mkdtemp(dir=expanduser("~"))
+            self.tardir = os.path.join(self.tempdir, str(self.uniq))
+        else:
+            # Part of a MultiCrashCollector run, which owns the tempdir.
+            self.tempdir = None
+            self.tardir = workdir
         os.mkdir(self.tardir)
         os.chdir(self.tardir)
         self.output_dir = output_dir or "."
@@ -257,11 +619,45 @@ class CrashCollector(object):
         self.journalctl = journalctl
         self.unit_dump_location = unit_dump_location
         self.as_root = as_root
+        self.addons_cache = addons_cache
+        self.addons_push = addons_push
+        self.addons_push_fanout = addons_push_fanout
+        self.debug_log_jobs = debug_log_jobs
+        self.caas_log_since = caas_log_since
+        self.caas_jobs = caas_jobs
+        # Whether to gzip the largest captures, the debug-log and pod logs,
+        # while they are written.
+        self.compress_captures = compress_captures
+        self.archive_format = archive_format
+        self.triage = triage
+        # None, or the (since, until) window of the timeline to write.
+        self.timeline = timeline
+        # None, or the patterns to redact in addition to the builtin rules.
+        self.redact = redact
+        self.keep_unit_dumps = keep_unit_dumps
+        self.preflight = preflight
+        if fallback_dump_locations is None:
+            fallback_dump_locations = FALLBACK_DUMP_LOCATIONS
+        self.fallback_dump_locations = fallback_dump_locations
+        # Where the pre-flight check put the tarball of each machine, None
+        # for those streamed over ssh. Machines not in here use the unit
+        # dump location.
+        self.dump_locations = {}
+        self.ssh_policy = retry.SSH
+        self.transfer_policy = retry.TRANSFER
+        if retries is not None:
+            self.ssh_policy = retry.SSH.with_attempts(retries + 1)
+            self.transfer_policy = retry.TRANSFER.with_attempts(retries + 1)
+        self.budget = retry.ErrorBudget(error_budget)
+        # None, or the upload.Uploader to upload the unit tarballs with as
+        # soon as they are retrieved, see upload_part.
+        self.uploader = uploader
+        # The uploaded parts, as {name: machine directory}.
+        self.parts = {}
+        # The number of commands that could not reach each machine.
+        self.unreachable = defaultdict(int)
+        self.skip_machines = skip_machines or set()
         self._machines = None
-        ssh_agent_setup.setup()
-        ssh_agent_setup.add_key(
-            os.path.join(os.path.expanduser("~"), ".local/share/juju/ssh/juju_id_rsa")
-        )
 
     def get_all(self):
         if self._machines:
@@ -269,6 +665,8 @@ class CrashCollector(object):
         machines = {}
         juju_status = self.status
         for machine, machine_data in juju_status["machines"].items():
+            if machine in self.skip_machines:
+                continue
             try:
                 machines[machine] = [
                     "ubuntu@{}".format(ip) for ip in machine_data["ip-addresses"]
@@ -279,6 +677,8 @@ class CrashCollector(object):
             if "containers" in juju_status["machines"][machine]:
                 containers = juju_status["machines"][machine]["containers"]
                 for container, container_data in containers.items():
+                    if container in self.skip_machines:
+                        continue
                     try:
                         machines[container] = [
                             "ubuntu@{}".format(ip)
@@ -311,20 +711,96 @@ class CrashCollector(object):
 
         return machines
 
+    def _submit_all(self, function, calls):
+        # Call function for each machine, calls is a mapping of
+        # {machine: args}. Machines it returns False for couldn't be
+        # reached, which ends up in the collection report.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
+            futures = {
+                machine: executor.submit(function, *args)
+                for machine, args in calls.items()
+            }
+        for machine, future in futures.items():
+            if not future.result():
+                self.unreachable[machine] += 1
+
     def _run_all(self, cmd):
+        self._run_each({machine: cmd for machine in self.get_all()})
+
+    def _run_each(self, commands):
+        # Run a different command on each machine, commands is a mapping
+        # of {machine: command}.
+        all_machines = self.get_all()
+        self._submit_all(
+            run_ssh,
+            {
+                machine: (
+                    all_machines[machine],
+                    self.timeout,
+                    SSH_CMD,
+                    cmd,
+                    self.ssh_policy,
+                    self.budget,
+                )
+                for machine, cmd in commands.items()
+            },
+        )
+
+    def _query_all(self, cmd):
+        # Run cmd on all machines, return a mapping of {machine: output} of
+        # those where it ran.
         all_machines = self.get_all()
         with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-            [
-                executor.submit(run_ssh, ips, self.timeout, SSH_CMD, cmd)
-                for _, ips in all_machines.items()
-            ]
+            futures = {
+                machine: executor.submit(
+                    run_ssh_output, ips, self.timeout, SSH_CMD, cmd
+                )
+                for machine, ips in all_machines.items()
+            }
+        return {
+            machine: future.result()
+            for machine, future in futures.items()
+            if future.result() is not None
+        }
+
+    def _push_all(self, files, remote_dir):
+        self._submit_all(
+            run_scp,
+            {
+                machine: (
+                    ips,
+                    self.timeout,
+                    files,
+                    remote_dir,
+                    self.ssh_policy,
+                    self.budget,
+                )
+                for machine, ips in self.get_all().items()
+            },
+        )
+
+    @property
+    def aliases(self):
+        aliases = service_unit_addresses(self.status)
+        for machine in self.skip_machines:
+            aliases.pop(machine, None)
+        return aliases
 
     def run_addons(self):
-        services = service_unit_addresses(self.status)
+        services = self.aliases
         machines = services.keys()
         if not machines:
             return
         units = [v for v in list(set.union(*list(services.values()))) if "/" in v]
+        addresses = machine_addresses(self.status)
+        distribution = PayloadDistribution(
+            self.addons_push,
+            addresses={m: address for m, (address, _) in addresses.items()},
+            zones={m: zone for m, (_, zone) in addresses.items()},
+            controllers=sorted(self.controller_status.get("machines", {})),
+            controller_model=self.controller_model,
+            fanout=self.addons_push_fanout,
+        )
         if self.addons_file is not None and self.addons is not None:
             return do_addons(
                 self.addons_file,
@@ -334,6 +810,8 @@ class CrashCollector(object):
                 self.unit_dump_location,
                 self.uniq,
                 self.as_root,
+                cache=self.addons_cache,
+                distribution=distribution,
             )
 
     def run_journalctl(self):
@@ -350,64 +828,299 @@ class CrashCollector(object):
                 "true".format(logdir=logdir, logfile=logfile, service=service)
             )
 
-    def create_unit_tarballs(self):
+    @property
+    def directories(self):
         directories = list(DIRECTORIES)
         directories.extend(self.extra_dirs)
         directories.extend(
             ["/var/lib/lxd/containers/*/rootfs" + item for item in directories]
         )
         directories.append(".")
-
+        return directories
+
+    def tar_cmd(self, location):
+        """Return the command creating the unit tarball in location, or
+        writing it to stdout if location is None."""
+        tarball = "../juju-dump-{uniq}.tar"
+        if location is None:
+            tarball = "-"
+        elif location != self.unit_dump_location:
+            tarball = "{location}/{uniq}/juju-dump-{uniq}.tar"
+        if self.redact is None:
+            archive_cmd = (
+                "{sudo}tar -pcf %s{excludes} --files-from - 2>/dev/null" % tarball
+            )
+        else:
+            # Redact the tar stream on its way to the unit tarball.
+            archive_cmd = (
+                "{sudo}tar -pcf -{excludes} --files-from - 2>/dev/null"
+                " | python3 ../redact.py ../redact.json"
+            )
+            if location is not None:
+                archive_cmd += " > %s" % tarball
         tar_cmd = (
             "mkdir -p {dump_location}/{uniq}/addon_output; "
             "cd {dump_location}/{uniq}/addon_output; "
             "{sudo}find {dirs} -mount -type f -size -{max_size}c -o -size "
-            "{max_size}c 2>/dev/null | {sudo}tar -pcf ../juju-dump-{uniq}.tar"
-            "{excludes}"
-            " --files-from - 2>/dev/null"
-        ).format(
-            dirs=" ".join(directories),
+            "{max_size}c 2>/dev/null | " + archive_cmd
+        )
+        if location is not None and location != self.unit_dump_location:
+            tar_cmd = "mkdir -p {location}/{uniq}; " + tar_cmd
+        return tar_cmd.format(
+            dirs=" ".join(self.directories),
             max_size=self.max_size,
             excludes="".join([" --exclude {}".format(x) for x in self.exclude]),
             uniq=self.uniq,
             sudo="sudo " if self.as_root else "",
             dump_location=self.unit_dump_location,
+            location=location,
         )
+
+    def check_unit_space(self):
+        """Estimate the size of the unit tarballs and check the free space on
+        the units, to decide where each tarball is written, see
+        choose_dump_location."""
+        locations = [self.unit_dump_location] + [
+            location
+            for location in self.fallback_dump_locations
+            if location != self.unit_dump_location
+        ]
+        # The size of the files the tarball will hold, then a
+        # "<location> <available KiB>" line per location.
+        preflight_cmd = (
+            "mkdir -p {dump_location}/{uniq}/addon_output; "
+            "cd {dump_location}/{uniq}/addon_output; "
+            "{sudo}find {dirs} -mount -type f \\( -size -{max_size}c -o -size "
+            '{max_size}c \\) -printf "%s\\n" 2>/dev/null'
+            ' | awk "{{s+=\\$1}} END {{print s+0}}"; '
+            "for d in {locations}; do "
+            'echo $d $(df -Pk $d 2>/dev/null | awk "NR==2 {{print \\$4}}"); done'
+        ).format(
+            dirs=" ".join(self.directories),
+            max_size=self.max_size,
+            uniq=self.uniq,
+            sudo="sudo " if self.as_root else "",
+            dump_location=self.unit_dump_location,
+            locations=" ".join(locations),
+        )
+        for machine, output in self._query_all(preflight_cmd).items():
+            try:
+                estimate, available = parse_preflight(output)
+            except (IndexError, ValueError):
+                continue
+            location = choose_dump_location(estimate, available, locations)
+            self.dump_locations[machine] = location
+            if location is None:
+                logging.warning(
+                    "Not enough space on %s for its tarball of about %d MB, "
+                    "streaming it instead." % (machine, estimate // 1000000)
+                )
+            elif location != self.unit_dump_location:
+                logging.warning(
+                    "Not enough space in %s on %s, writing its tarball to %s."
+                    % (self.unit_dump_location, machine, location)
+                )
+
+    def create_unit_tarballs(self):
         self._run_all(
             "mkdir -p {dump_location}/{uniq}".format(
                 dump_location=self.unit_dump_location, uniq=self.uniq
             )
         )
+        if self.redact is not None:
+            self.push_redact_rules()
+
+        if all(
+            location == self.unit_dump_location
+            for location in self.dump_locations.values()
+        ):
+            self._run_all(self.tar_cmd(self.unit_dump_location))
+            return
+        # Streamed tarballs are created while they are retrieved.
+        self._run_each(
+            {
+                machine: self.tar_cmd(
+                    self.dump_locations.get(machine, self.unit_dump_location)
+                )
+                for machine in self.get_all()
+                if self.dump_locations.get(machine, self.unit_dump_location)
+            }
+        )
+
+    def cleanup_units(self):
+        """Remove the unit dumps, wherever they were written, from the units."""
+        locations = set([self.unit_dump_location])
+        locations.update(
+            location for location in self.dump_locations.values() if location
+        )
+        self._run_all(
+            ("sudo " if self.as_root else "")
+            + "rm -rf "
+            + " ".join(
+                "{}/{}".format(location, self.uniq) for location in sorted(locations)
+            )
+        )
 
-        self._run_all(tar_cmd)
+    def push_redact_rules(self):
+        """Push the redaction filter and its rules to all machines."""
+        rules_dir = tempfile.mkdtemp()
+        try:
+            rules = os.path.join(rules_dir, "redact.json")
+            with open(rules, "w") as fd:
+                json.dump({"builtin": True, "patterns": self.redact}, fd)
+            self._push_all(
+                [redact.__file__, rules],
+                "{dump_location}/{uniq}".format(
+                    dump_location=self.unit_dump_location, uniq=self.uniq
+                ),
+            )
+        finally:
+            shutil.rmtree(rules_dir)
 
     @property
     def status(self):
-        juju_status = yaml.load(open("juju_status.yaml", "r"), Loader=yaml.FullLoader)
-        return juju_status
+        return load_status("juju_status.yaml")
 
     @property
     def controller_status(self):
-        juju_status = yaml.load(
-            open("juju_status_controller.yaml", "r"), Loader=yaml.FullLoader
+        return load_status("juju_status_controller.yaml")
+
+    @property
+    def controller_model(self):
+        # The controller model of the controller the model is on.
+        if self.model and ":" in self.model:
+            return "%s:controller" % self.model.split(":")[0]
+        return "controller"
+
+    def remote_tarball(self, machine):
+        # The path of the tarball on the machine, None if it is streamed.
+        location = self.dump_locations.get(machine, self.unit_dump_location)
+        if location is None:
+            return None
+        return "{location}/{uniq}/juju-dump-{uniq}.tar".format(
+            location=location, uniq=self.uniq
         )
-        return juju_status
+
+    def fetch_unit_tarball(self, machine, routes, stragglers):
+        # Fetch the tarball of machine over its routes, retrying as the
+        # transfer policy and error budget allow. Returns its file, or None.
+        output = "%s.tar" % uuid.uuid4()
+        if retry.retry(
+            lambda: fetch_unit_tarball(routes, output, stragglers),
+            self.transfer_policy,
+            self.budget,
+            "Retrieving the tarball of %s" % machine,
+        ):
+            if self.uploader is not None:
+                self.upload_part(machine, output)
+            return output
+        logging.warning("Unable to retrieve tarball for %s. Skipping." % machine)
+        return None
+
+    def upload_part(self, machine, tarball):
+        # Start uploading the tarball of machine while the others are still
+        # being retrieved. It is extracted meanwhile, so upload a link.
+        name = "juju-crashdump-%s-%s.tar" % (self.uniq, machine.replace("/", "_"))
+        part = self.uploader.part_path(name)
+        try:
+            os.link(tarball, part)
+        except OSError:
+            shutil.copyfile(tarball, part)
+        self.uploader.submit(part, name, compress=True)
+        self.parts[name + ".gz"] = machine_directory(machine)
+
+    def upload_rest(self):
+        """Upload what isn't in the machine parts yet: the model level files
+        and the machines without a part, and how to put them together."""
+        with open("upload_parts.yaml", "w") as fd:
+            yaml.safe_dump(self.parts, fd, default_flow_style=False)
+        name = "juju-crashdump-%s-model.tar.%s" % (self.uniq, self.compression)
+        path = self.uploader.part_path(name)
+        run_cmd(
+            "cd %s && tar -pacf %s --anchored%s * 2>/dev/null"
+            % (
+                self.tempdir,
+                path,
+                "".join(
+                    " --exclude=%s/%s" % (os.path.basename(self.tardir), directory)
+                    for directory in sorted(self.parts.values())
+                ),
+            )
+        )
+        self.uploader.submit(path, name)
 
     def retrieve_unit_tarballs(self):
         all_machines = self.get_all()
-        aliases = service_unit_addresses(self.status)
+        aliases = self.aliases
         if not aliases:
             # Running against an empty model.
             logging.warning("0 machines found. No tarballs to retrieve.")
             return
+        # Fetch in threads, so stragglers can be told from the transfers
+        # that finished, then extract in processes.
+        stragglers = retry.Stragglers()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
+            tarballs = {
+                machine: executor.submit(
+                    self.fetch_unit_tarball,
+                    machine,
+                    unit_tarball_routes(
+                        machine,
+                        all_machines.get(machine, []),
+                        self.remote_tarball(machine),
+                        None if self.remote_tarball(machine) else self.tar_cmd(None),
+                    ),
+                    stragglers,
+                )
+                for machine in aliases
+            }
+        states = {machine: "missing" for machine in aliases}
         pool = multiprocessing.Pool()
-        pool.map(
-            retrieve_single_unit_tarball,
+        results = pool.map(
+            extract_unit_tarball,
             [
-                (self.uniq, key, value, all_machines, self.unit_dump_location)
-                for key, value in aliases.items()
+                (machine, aliases[machine], future.result(), self.triage)
+                for machine, future in tarballs.items()
+                if future.result() is not None
             ],
         )
+        pool.close()
+        findings = triage.Triage()
+        for machine, state, result in results:
+            states[machine] = state
+            if result is not None:
+                findings.update(result)
+        if self.triage:
+            triage.write_summary(self.status, findings)
+        self.write_report(states)
+
+    def write_report(self, states, path="collection_report.yaml"):
+        """Write which machines were collected completely, partially or not
+        at all, given the state of their tarballs, see extract_unit_tarball."""
+        report = {"complete": [], "partial": [], "missing": [], "problems": {}}
+        for machine, state in sorted(states.items()):
+            problems = []
+            if state == "missing":
+                problems.append("no tarball retrieved")
+            elif state == "partial":
+                problems.append("tarball only partly extracted")
+            if self.unreachable.get(machine):
+                problems.append(
+                    "unreachable for %d commands" % self.unreachable[machine]
+                )
+                if state == "complete":
+                    state = "partial"
+            report[state].append(machine)
+            if problems:
+                report["problems"][machine] = problems
+        with open(path, "w") as fd:
+            yaml.safe_dump(report, fd, default_flow_style=False)
+        logging.info(
+            "Collected %d machines completely, %d partially and %d not at all."
+            % (len(report["complete"]), len(report["partial"]), len(report["missing"]))
+        )
+        for machine, problems in sorted(report["problems"].items()):
+            logging.warning("%s: %s" % (machine, ", ".join(problems)))
 
     def get_caas_stuff(self):
         juju_status = self.status
@@ -426,12 +1139,37 @@ class CrashCollector(object):
             "kubectl -n %s get pods" % (juju_status["model"]["name"]),
             to_file="pods.txt",
         )
+        collect_kubernetes(
+            juju_status["model"]["name"],
+            since=self.caas_log_since,
+            jobs=self.caas_jobs,
+            compress=self.compress_captures,
+        )
 
     def collect(self):
+        self.collect_model()
+        if self.uploader is not None:
+            self.upload_rest()
+        tar_file = archive_dump(
+            self.tempdir,
+            self.uniq,
+            self.compression,
+            self.cwd,
+            self.output_dir,
+            self.archive_format,
+        )
+        self.cleanup()
+        return tar_file
+
+    def collect_model(self):
+        setup_ssh_agent()
         juju_check()
-        juju_status()
+        juju_status(self.controller_model)
         if "debug_log.txt" not in self.exclude:
-            juju_debuglog()
+            if self.debug_log_jobs > 1:
+                collect_debuglog(self.status, jobs=self.debug_log_jobs)
+            else:
+                juju_debuglog(self.compress_captures)
         if "model_config.yaml" not in self.exclude:
             juju_model_defaults()
         if "storage.yaml" not in self.exclude:
@@ -439,58 +1177,159 @@ class CrashCollector(object):
         if "storage_pools.yaml" not in self.exclude:
             juju_storage_pools()
         self.get_caas_stuff()
-        self.run_addons()
-        self.run_journalctl()
-        self.create_unit_tarballs()
-        self.retrieve_unit_tarballs()
-        os.chdir(self.tempdir)
-        tar_file = "juju-crashdump-%s.tar.%s" % (self.uniq, self.compression)
-        run_cmd("tar -pacf %s * 2>/dev/null" % tar_file)
-        os.chdir(self.cwd)
-        shutil.move(os.path.join(self.tempdir, tar_file), self.output_dir)
-        self.cleanup()
-        return tar_file
+        try:
+            self.run_addons()
+            self.run_journalctl()
+            if self.preflight:
+                self.check_unit_space()
+            self.create_unit_tarballs()
+            self.retrieve_unit_tarballs()
+        finally:
+            if not self.keep_unit_dumps:
+                self.cleanup_units()
+        if self.timeline is not None:
+            timeline.write_timeline(".", "timeline.txt", *self.timeline)
+        with open("capture_stats.yaml", "w") as fd:
+            yaml.safe_dump(CAPTURES, fd, default_flow_style=False)
 
     def cleanup(self):
         shutil.rmtree(self.tempdir)
 
 
-def upload_file_to_bug(bugnum, file_):
-    if not APPORT:
-        # We guard against this by checking for APPORT when the script
-        # first runs (see bottom of this file). Just in case we get
-        # here without apport, inform the user and skip this routine.
-        logging.warning(
-            "Apport not available in this environment. Skipping upload file to bug."
-        )
-        return
-    crashdb = crashdb = apport.crashdb.get_crashdb(None)
-    if not crashdb.can_update(bugnum):
-        logging.warning(
-            dedent(
-                """
-            You are not the reporter or subscriber of this problem report,
-            or the report is a duplicate or already closed.
+def archive_dump(tempdir, uniq, compression, cwd, output_dir, archive_format="tar"):
+    """Tar up the crashdump in tempdir and move it to output_dir."""
+    os.chdir(tempdir)
+    if archive_format == "indexed":
+        tar_file = "juju-crashdump-%s.%s" % (uniq, archive.EXTENSION)
+        codec = compression if compression in archive.CODECS else "xz"
+        archive.write_archive(".", tar_file, codec)
+    else:
+        tar_file = "juju-crashdump-%s.tar.%s" % (uniq, compression)
+        run_cmd("tar -pacf %s * 2>/dev/null" % tar_file)
+    os.chdir(cwd)
+    shutil.move(os.path.join(tempdir, tar_file), output_dir)
+    return tar_file
+
+
+def model_status(model):
+    """Return the juju status of the given [controller:]model."""
+    output = subprocess.check_output(
+        ["juju", "status", "-m", model, "--format=yaml"], stderr=FNULL
+    )
+    return yaml.safe_load(output)
+
 
-            Please create a new report on https://bugs.launchpad.net/charms.
-            """
+def model_statuses(models):
+    """Return [(model, juju status)] of the given models, leaving out the
+    models whose status can't be fetched, e.g. misspelled or unreachable."""
+    statuses = []
+    for model in models:
+        try:
+            statuses.append((model, model_status(model)))
+        except subprocess.CalledProcessError as e:
+            logging.warning("Unable to get the status of model %s, skipping it." % model)
+            logging.warning(e)
+    return statuses
+
+
+def shared_machines(statuses):
+    """From a given list of (model, juju_status.yaml dict) return a mapping of
+    {model: set(['machine/container'])} of the machines that are a machine of
+    a model earlier in the list, by dns-name or instance-id, e.g. the
+    controller hosts when collecting both the controller model and a model
+    hosted on them. The other ip-addresses aren't compared, bridges such as
+    virbr0 or docker0 have the same address on unrelated hosts."""
+    seen = set()
+    out = {}
+    for model, status in statuses:
+        out[model] = set()
+        machines = list(status["machines"].items())
+        for _, m_info in list(machines):
+            machines.extend(m_info.get("containers", {}).items())
+        model_keys = set()
+        for m_id, m_info in machines:
+            keys = set(
+                (key, m_info[key])
+                for key in ("dns-name", "instance-id")
+                if m_info.get(key) not in (None, "", "pending")
             )
-        )
-        return False
+            if keys & seen:
+                out[model].add(m_id)
+            model_keys.update(keys)
+        seen.update(model_keys)
+    return out
+
+
+def model_directory(model):
+    # One directory per model, e.g. ctrl_admin_k8s for ctrl:admin/k8s.
+    return re.sub(r"[:/]", "_", model)
+
+
+def collect_model(model, workdir, skip_machines, kwargs):
+    CrashCollector(
+        model, workdir=workdir, skip_machines=skip_machines, **kwargs
+    ).collect_model()
+
+
+class MultiCrashCollector(object):
+    """Collect several models, possibly of different controllers, at once.
+
+    Each model is collected by a CrashCollector in its own process, so it
+    has its own JUJU_MODEL and working directory, into a directory named
+    after the model. Machines shared between the models are only collected
+    for the first model they appear in. The result is a single crashdump.
+    """
+
+    def __init__(
+        self,
+        models,
+        output_dir=None,
+        uniq=None,
+        compression="xz",
+        archive_format="tar",
+        **kwargs
+    ):
+        self.models = models
+        self.cwd = os.getcwd()
+        self.uniq = uniq or uuid.uuid4()
+        self.tempdir = tempfile.mkdtemp(dir=expanduser("~"))
+        self.tardir = os.path.join(self.tempdir, str(self.uniq))
+        os.mkdir(self.tardir)
+        self.output_dir = output_dir or "."
+        self.compression = compression
+        self.archive_format = archive_format
+        self.kwargs = dict(kwargs, uniq=self.uniq)
 
-    is_reporter = crashdb.is_reporter(bugnum)
-
-    report = apport.Report("Bug")
-    apport.hookutils.attach_file(report, file_, overwrite=False)
-    if len(report) != 0:
-        logging.info("Starting upload to lp:%s" % bugnum)
-        crashdb.update(
-            bugnum,
-            report,
-            "apport information",
-            change_description=is_reporter,
-            attachment_comment="juju crashdump",
+    def collect(self):
+        # Once here, so the model processes share the agent.
+        setup_ssh_agent()
+        statuses = model_statuses(self.models)
+        skip = shared_machines(statuses)
+        procs = []
+        for model, _ in statuses:
+            workdir = os.path.join(self.tardir, model_directory(model))
+            proc = multiprocessing.Process(
+                target=collect_model, args=(model, workdir, skip[model], self.kwargs)
+            )
+            proc.start()
+            procs.append((model, proc))
+        for model, proc in procs:
+            proc.join()
+            if proc.exitcode != 0:
+                logging.warning("Collecting model %s failed" % model)
+        tar_file = archive_dump(
+            self.tempdir,
+            self.uniq,
+            self.compression,
+            self.cwd,
+            self.output_dir,
+            self.archive_format,
         )
+        self.cleanup()
+        return tar_file
+
+    def cleanup(self):
+        shutil.rmtree(self.tempdir)
 
 
 class ShowDescription(argparse.Action):
@@ -513,18 +1352,38 @@ def parse_args():
         action=ShowDescription,
         help="Output a short description of the plugin",
     )
-    parser.add_argument("-m", "--model", default=None, help="Model to act on")
+    parser.add_argument(
+        "-m",
+        "--model",
+        action="append",
+        help="Model to act on, as [controller:]model. Pass several times to "
+        "collect several models into one crashdump.",
+    )
     parser.add_argument(
         "-f",
         "--max-file-size",
         default=MAX_FILE_SIZE,
         help="The max file size (bytes) for included files. " "(default: %(default)s)",
     )
+    upload.add_backend_arguments(parser)
     parser.add_argument(
-        "-b",
-        "--bug",
-        default=None,
-        help="Upload crashdump to the given launchpad bug #",
+        "--upload-parts",
+        action="store_true",
+        help="Upload the unit tarballs as soon as they are retrieved, while the "
+        "other\nmachines are still being collected, then the rest. For a single "
+        "model.",
+    )
+    parser.add_argument(
+        "--upload-jobs",
+        type=int,
+        default=upload.UPLOAD_JOBS,
+        help="Upload this many chunks at a time. (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--upload-chunk-size",
+        type=int,
+        default=upload.CHUNK_SIZE,
+        help="Upload in chunks of this many bytes. (default: %(default)s)",
     )
     parser.add_argument(
         "extra_dir", nargs="*", default=[], help="Extra directories to snapshot"
@@ -542,6 +1401,14 @@ def parse_args():
         help="The compression type to use for result tarball. "
         "(default: %(default)s)",
     )
+    parser.add_argument(
+        "--format",
+        choices=("tar", "indexed"),
+        default="tar",
+        help="The format of the result: a compressed tarball, or an indexed "
+        "archive\nof separately compressed files that 'juju-crashdump inspect' "
+        "can read\nwithout extracting it. (default: %(default)s)",
+    )
     parser.add_argument(
         "-o", "--output-dir", help="Store the completed crash dump in this dir."
     )
@@ -604,29 +1471,173 @@ def parse_args():
         default="/tmp",
         help="path to dump crashdump on units (default: %(default)s)",
     )
+    parser.add_argument(
+        "--unit-dump-fallback",
+        action="append",
+        help="Write the unit tarball here instead when the unit dump location is "
+        "short on\nspace, pass several times to try several paths. Without room "
+        "anywhere, the\ntarball is streamed over ssh. (default: %s)"
+        % " ".join(FALLBACK_DUMP_LOCATIONS),
+    )
+    parser.add_argument(
+        "--no-preflight",
+        action="store_true",
+        help="Don't check the free space on the units before creating the unit "
+        "tarballs.",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        help="Retry ssh commands that could not connect and unit tarball transfers "
+        "up to\nthis many times, backing off in between. (default: %d and %d)"
+        % (retry.SSH.attempts - 1, retry.TRANSFER.attempts - 1),
+    )
+    parser.add_argument(
+        "--error-budget",
+        type=int,
+        default=retry.ERROR_BUDGET,
+        help="Retry at most this many times in the whole collection. "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--keep-unit-dumps",
+        action="store_true",
+        help="Leave the dumps on the units instead of removing them once they are "
+        "retrieved.",
+    )
     parser.add_argument(
         "--as-root",
         action="store_true",
-        help="Collect logs as root, may contain passwords etc. Addons with local "
-        "commands will only run if this flag is enabled. (default: %(default)s)",
+        help="Collect logs as root, may contain passwords etc, see --redact. Addons "
+        "with local\ncommands will only run if this flag is enabled. "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--redact",
+        action="store_true",
+        help="Redact passwords, transport_urls, tokens and other secrets on the "
+        "units,\nwhile the unit tarballs are created. (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--redact-pattern",
+        action="append",
+        default=[],
+        help="Also redact matches of this python regular expression in all files, "
+        "implies\n--redact. If it has groups, the text matched by the first is kept.",
+    )
+    parser.add_argument(
+        "--addons-cache-dir",
+        type=str,
+        default=CACHE_DIR,
+        help="Cache the files created by cached addon local commands in this dir "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-addons-cache",
+        action="store_true",
+        help="Always rerun addon local commands instead of using the cache.",
+    )
+    parser.add_argument(
+        "--addons-push",
+        choices=PUSH_MODES,
+        default="direct",
+        help="How files created by addon local commands reach the machines:\n"
+        "direct: upload them to every machine,\n"
+        "controller: upload them once to a controller machine,\n"
+        "zone: upload them once to a machine in each availability zone,\n"
+        "and relay them from there to the other machines. (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--addons-push-fanout",
+        type=int,
+        default=FANOUT,
+        help="Number of machines each machine relays addon files to. "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--debug-log-jobs",
+        type=int,
+        default=1,
+        help="Fetch the debug-log with this many parallel queries, merged into a "
+        "compressed debug_log.txt.gz. (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--triage",
+        action="store_true",
+        help="Scan the unit logs while they are extracted and write a summary of "
+        "units\nin error, failed hooks, tracebacks, OOM kills and juju-db errors to "
+        "\nsummary.txt and summary.yaml. (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--timeline",
+        action="store_true",
+        help="Merge the debug-log, juju logs, syslog and journalctl logs of all "
+        "machines\ninto one time ordered timeline.txt. (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--timeline-since",
+        help="Start the timeline at this time, as YYYY-MM-DD HH:MM:SS or a prefix.",
+    )
+    parser.add_argument(
+        "--timeline-until",
+        help="End the timeline at this time, as YYYY-MM-DD HH:MM:SS or a prefix.",
+    )
+    parser.add_argument(
+        "--caas-log-since",
+        type=str,
+        default=None,
+        help="Only collect pod logs newer than this duration, e.g. 24h, for CaaS "
+        "models. (default: all)",
+    )
+    parser.add_argument(
+        "--caas-jobs",
+        type=int,
+        default=KUBECTL_JOBS,
+        help="Number of kubectl commands to run at once for CaaS models. "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--compress-captures",
+        action="store_true",
+        help="Gzip the debug-log and the CaaS pod logs while they are written.",
     )
     return parser.parse_args()
 
 
+SUBCOMMANDS = {
+    "inspect": archive.main,
+    "search": search.main,
+    "timeline": timeline.main,
+    "upload": upload.main,
+}
+
+
 def main():
+    if sys.argv[1:2] and sys.argv[1] in SUBCOMMANDS:
+        return SUBCOMMANDS[sys.argv[1]](sys.argv[2:])
     opts = parse_args()
     numeric_level = getattr(logging, opts.logging_level.upper(), None)
     if not isinstance(numeric_level, int):
         raise ValueError("Invalid log level: %s" % opts.logging_level)
     logging.basicConfig(format="%(asctime)s - %(message)s", level=numeric_level)
     logging.info("juju-crashdump started.")
-    if opts.bug and not APPORT:
+    if opts.bug and not upload.launchpad_available():
         logging.warning(
-            "Apport not available in this environment.\n"
-            + "You must 'apt install' apport to use the 'bug' option.\n"
+            "launchpadlib not available in this environment.\n"
+            + "You must 'apt install' python3-launchpadlib to use the 'bug' option.\n"
             + "Aborting run."
         )
         return
+    uploader = None
+    backend = upload.backend_from_args(opts)
+    if backend is not None:
+        uploader = upload.Uploader(
+            backend,
+            opts.upload_jobs,
+            opts.upload_chunk_size,
+            staging_dir=expanduser("~"),
+            keep_dir=opts.output_dir,
+        )
     if not opts.small:
         DIRECTORIES.append("/var/lib/juju")
     if not opts.addons_file:
@@ -637,8 +1648,10 @@ def main():
     if opts.as_root:
         opts.addon = (opts.addon if opts.addon else []) + ["listening", "psaux"]
         opts.addon = list(set(opts.addon))
-    collector = CrashCollector(
-        model=opts.model,
+    addons_cache = None
+    if not opts.no_addons_cache:
+        addons_cache = ArtifactCache(opts.addons_cache_dir)
+    kwargs = dict(
         max_size=opts.max_file_size,
         extra_dirs=opts.extra_dir,
         output_dir=opts.output_dir,
@@ -650,11 +1663,51 @@ def main():
         timeout=opts.timeout,
         journalctl=opts.journalctl,
         unit_dump_location=opts.unit_dump_location,
+        fallback_dump_locations=opts.unit_dump_fallback,
+        preflight=not opts.no_preflight,
+        keep_unit_dumps=opts.keep_unit_dumps,
+        retries=opts.retries,
+        error_budget=opts.error_budget,
         as_root=opts.as_root,
+        addons_cache=addons_cache,
+        addons_push=opts.addons_push,
+        addons_push_fanout=opts.addons_push_fanout,
+        debug_log_jobs=opts.debug_log_jobs,
+        caas_log_since=opts.caas_log_since,
+        caas_jobs=opts.caas_jobs,
+        compress_captures=opts.compress_captures,
+        archive_format=opts.format,
+        triage=opts.triage,
+        timeline=(
+            (opts.timeline_since, opts.timeline_until) if opts.timeline else None
+        ),
+        redact=(
+            opts.redact_pattern if opts.redact or opts.redact_pattern else None
+        ),
     )
-    filename = collector.collect()
-    if opts.bug:
-        upload_file_to_bug(opts.bug, filename)
+    upload_parts = opts.upload_parts and uploader is not None
+    if opts.model and len(opts.model) > 1:
+        if upload_parts:
+            logging.warning("Uploading parts is for a single model, uploading it whole.")
+            upload_parts = False
+        collector = MultiCrashCollector(opts.model, **kwargs)
+    else:
+        collector = CrashCollector(
+            opts.model[0] if opts.model else None,
+            uploader=uploader if upload_parts else None,
+            **kwargs
+        )
+    filename = os.path.join(opts.output_dir or ".", collector.collect())
+    if uploader is not None:
+        if not upload_parts:
+            uploader.submit(filename)
+        failed = uploader.wait()
+        if failed:
+            logging.warning(
+                "Not all of the crashdump was uploaded, resume with "
+                "'juju-crashdump upload <file>' and the same upload options for: %s"
+                % " ".join(failed)
+            )
     logging.info("juju-crashdump finished.")
 
 
@@ -0,0 +1,103 @@
+import concurrent.futures
+import gzip
+import heapq
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+
+from jujucrashdump.addons import FNULL
+
+DEBUGLOG_CMD = ["juju", "debug-log", "--date", "--replay", "--no-tail"]
+# The controller only allows 10 connections at once.
+MAX_JOBS = 10
+# With --date every record starts with "<entity>: <date> <time> <level> ...",
+# lines that don't are continuations of the previous record, e.g. tracebacks.
+RECORD_RE = re.compile(rb"^\S+: (\d{4}-\d\d-\d\d \d\d:\d\d:\d\d(?:\.\d+)?) ")
+
+
+def entities(status):
+    """From a given juju_status.yaml dict return the tags of all the
+    machines, containers and units that can be passed to --include."""
+    tags = []
+    for m_id, m_info in status["machines"].items():
+        tags.append("machine-%s" % m_id.replace("/", "-"))
+        for c_id in m_info.get("containers", {}):
+            tags.append("machine-%s" % c_id.replace("/", "-"))
+    for a_info in status["applications"].values():
+        for u_id, u_info in a_info.get("units", {}).items():
+            tags.append("unit-%s" % u_id.replace("/", "-"))
+            for s_id in u_info.get("subordinates", {}):
+                tags.append("unit-%s" % s_id.replace("/", "-"))
+    return sorted(set(tags))
+
+
+def queries(tags, jobs):
+    """Split the debug-log replay into jobs queries for disjoint sets of
+    entities, plus one query for everything else (model and application
+    level logs), so that together they return every record exactly once."""
+    groups = [tags[i::jobs] for i in range(jobs)]
+    args = [[arg for tag in group for arg in ("--include", tag)] for group in groups if group]
+    args.append([arg for tag in tags for arg in ("--exclude", tag)])
+    return args
+
+
+def fetch(args, path):
+    """Stream one debug-log query into a gzip compressed file."""
+    command = DEBUGLOG_CMD + args
+    logging.debug("Calling {}".format(" ".join(command)))
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=FNULL)
+    with gzip.open(path, "wb") as fd:
+        shutil.copyfileobj(proc.stdout, fd)
+    proc.stdout.close()
+    if proc.wait() != 0:
+        logging.warning('Command "%s" failed' % " ".join(command))
+        return False
+    logging.debug("Returned from {}".format(" ".join(command)))
+    return True
+
+
+def records(path):
+    """Yield (timestamp, record) from a gzip compressed debug-log, where a
+    record is a log line together with any continuation lines."""
+    with gzip.open(path, "rb") as fd:
+        key, record = b"", []
+        for line in fd:
+            match = RECORD_RE.match(line)
+            if match and record:
+                yield key, b"".join(record)
+                record = []
+            if match:
+                key = match.group(1)
+            record.append(line)
+        if record:
+            yield key, b"".join(record)
+
+
+def merge(paths, path):
+    """Merge the time ordered debug-logs in paths into one gzip file."""
+    with gzip.open(path, "wb") as fd:
+        for _, record in heapq.merge(*[records(p) for p in paths], key=lambda r: r[0]):
+            fd.write(record)
+
+
+def collect_debuglog(status, path="debug_log.txt.gz", jobs=4):
+    """Fetch the debug-log with jobs parallel queries and merge the results
+    in time order into path. Nothing but the current records of each query
+    is held in memory."""
+    jobs = max(1, min(jobs, MAX_JOBS - 1))
+    parts_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        parts = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs + 1) as executor:
+            futures = []
+            for i, args in enumerate(queries(entities(status), jobs)):
+                parts.append(os.path.join(parts_dir, "part-%d.txt.gz" % i))
+                futures.append(executor.submit(fetch, args, parts[-1]))
+            results = [f.result() for f in futures]
+        merge(parts, path)
+        return all(results)
+    finally:
+        shutil.rmtree(parts_dir)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Redact secrets from a tar stream.
+
+This is pushed to the units and run there, between tar and the unit
+tarball, so it only uses the standard library and runs on the python3 of
+any supported series:
+
+    find ... | tar -cf - --files-from - | python3 redact.py rules.json > dump.tar
+
+rules.json is {"builtin": true, "patterns": ["<regex>", ...]}. The builtin
+rules cover the service configs under /etc/*/ and credentials in URLs and
+keystone tokens anywhere. The extra patterns apply to every file. When a
+pattern has groups, the text matched by the first one is kept and the rest
+of the match is replaced, otherwise the whole match is.
+"""
+
+import io
+import json
+import re
+import sys
+import tarfile
+
+REDACTED = b"<redacted>"
+# (regex, only in files matching)
+BUILTIN_RULES = [
+    # password = ..., admin_token: ..., secret_key=... in /etc/<service>/,
+    # the word delimited by _ . or - so keystone_host = ... is kept.
+    (
+        rb"(?im)^([ \t]*(?:[\w.-]*[_.-])?"
+        rb"(?:password|passwd|secret|token|credentials?|key)"
+        rb"(?:[_.-][\w.-]*)?[ \t]*[=:][ \t]*)\S.*$",
+        r"(^|/)etc/[^/]+/",
+    ),
+    # transport_url, [database] connection and other URLs with credentials.
+    (
+        rb"(?im)^([ \t]*(?:transport_url|connection|sql_connection|backend_url)"
+        rb"[ \t]*=[ \t]*)\S.*$",
+        r"(^|/)etc/[^/]+/",
+    ),
+    (rb"(\w+://[^:/\s@]+:)[^@\s]+(?=@)", None),
+    # Keystone fernet tokens, and tokens in logged request headers.
+    (rb"gAAAAA[A-Za-z0-9_-]{40,}={0,2}", None),
+    (rb"(?i)(X-(?:Auth|Subject)-Token:?[ \t]*['\"]?)[^\s'\",}]+", None),
+]
+# Files with a NUL byte in their first block are left alone.
+BINARY_CHECK = 8192
+
+
+def compile_rules(config):
+    rules = []
+    if config.get("builtin", True):
+        for pattern, paths in BUILTIN_RULES:
+            rules.append((re.compile(pattern), paths and re.compile(paths)))
+    for pattern in config.get("patterns", []):
+        rules.append((re.compile(pattern.encode("utf-8")), None))
+    return rules
+
+
+def _replace(match):
+    if match.re.groups:
+        return match.group(1) + REDACTED
+    return REDACTED
+
+
+def redact(data, name, rules):
+    """Return data, the contents of the file name, with secrets redacted."""
+    if b"\0" in data[:BINARY_CHECK]:
+        return data
+    for regex, paths in rules:
+        if paths is None or paths.search(name):
+            data = regex.sub(_replace, data)
+    return data
+
+
+def redact_stream(src, dst, rules):
+    """Copy the tar stream src to dst, redacting the regular files."""
+    with tarfile.open(fileobj=src, mode="r|") as tar_in:
+        with tarfile.open(fileobj=dst, mode="w|", format=tarfile.GNU_FORMAT) as tar_out:
+            for member in tar_in:
+                if not member.isfile():
+                    tar_out.addfile(member)
+                    continue
+                data = redact(tar_in.extractfile(member).read(), member.name, rules)
+                member.size = len(data)
+                tar_out.addfile(member, io.BytesIO(data))
+
+
+def main(argv):
+    config = {}
+    if len(argv) > 1:
+        with open(argv[1]) as fd:
+            config = json.load(fd)
+    redact_stream(sys.stdin.buffer, sys.stdout.buffer, compile_rules(config))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,122 @@
+"""Retries with backoff, bounded by an error budget, and straggler hedging.
+
+A transient failure, like an ssh connection reset while a machine is busy,
+shouldn't leave that machine out of the crashdump. Each kind of operation
+has a RetryPolicy, saying how often it is tried and how long to wait in
+between, while the ErrorBudget bounds the retries of a whole collection, so
+a model that is down doesn't take attempts * machines * backoff to give up
+on. Stragglers tells the transfers that take far longer than the median of
+those finished so far, for which a second attempt over another route is
+started.
+"""
+
+import logging
+import random
+import threading
+import time
+
+# Retries allowed in a whole collection, over all machines and operations.
+ERROR_BUDGET = 50
+# Start a second attempt of a transfer once it runs this many times longer
+# than the median transfer, but only after this many transfers finished and
+# not before it ran this many seconds.
+HEDGE_FACTOR = 3
+HEDGE_MIN_SAMPLES = 3
+HEDGE_MIN_SECONDS = 30
+
+
+class RetryPolicy(object):
+    """Try an operation up to attempts times, waiting delay seconds after the
+    first failure and twice as long after each next one, up to max_delay."""
+
+    def __init__(self, attempts=3, delay=2.0, max_delay=30.0):
+        self.attempts = attempts
+        self.delay = delay
+        self.max_delay = max_delay
+
+    def delays(self):
+        """Yield the seconds to wait before each retry."""
+        delay = self.delay
+        for _ in range(self.attempts - 1):
+            # Jitter, so machines that failed together don't retry together.
+            yield delay * random.uniform(0.5, 1.0)
+            delay = min(delay * 2, self.max_delay)
+
+    def with_attempts(self, attempts):
+        return RetryPolicy(attempts, self.delay, self.max_delay)
+
+
+# Commands run on the units over ssh, and the unit tarball transfers.
+SSH = RetryPolicy(attempts=3, delay=2.0, max_delay=30.0)
+TRANSFER = RetryPolicy(attempts=3, delay=5.0, max_delay=60.0)
+
+
+class ErrorBudget(object):
+    """The number of retries left, shared by the threads of a collection."""
+
+    def __init__(self, retries=ERROR_BUDGET):
+        self.retries = retries
+        self.spent = 0
+        self._lock = threading.Lock()
+
+    def spend(self):
+        """Take a retry from the budget, return False if it is used up."""
+        with self._lock:
+            if self.spent >= self.retries:
+                return False
+            self.spent += 1
+            if self.spent == self.retries:
+                logging.warning(
+                    "Retried %d times, not retrying failures any more." % self.spent
+                )
+            return True
+
+
+def retry(operation, policy, budget=None, description="operation"):
+    """Call operation() until it returns something true, as often as the
+    policy and the budget allow. Return the last result."""
+    result = operation()
+    for delay in policy.delays():
+        if result or (budget is not None and not budget.spend()):
+            break
+        logging.info("%s failed, retrying in %.1fs." % (description, delay))
+        time.sleep(delay)
+        result = operation()
+    return result
+
+
+class Stragglers(object):
+    """Tells the transfers far slower than the median of those finished."""
+
+    def __init__(
+        self,
+        factor=HEDGE_FACTOR,
+        min_samples=HEDGE_MIN_SAMPLES,
+        min_seconds=HEDGE_MIN_SECONDS,
+    ):
+        self.factor = factor
+        self.min_samples = min_samples
+        self.min_seconds = min_seconds
+        self.durations = []
+        self._lock = threading.Lock()
+
+    def finished(self, seconds):
+        with self._lock:
+            self.durations.append(seconds)
+
+    def median(self):
+        with self._lock:
+            if len(self.durations) < self.min_samples:
+                return None
+            durations = sorted(self.durations)
+        middle = len(durations) // 2
+        if len(durations) % 2:
+            return durations[middle]
+        return (durations[middle - 1] + durations[middle]) / 2.0
+
+    def is_straggler(self, seconds):
+        """Whether a transfer that has run for seconds is worth hedging."""
+        median = self.median()
+        if median is None or seconds < self.min_seconds:
+            return False
+        return seconds > median * self.factor
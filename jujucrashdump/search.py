@@ -0,0 +1,276 @@
+"""The `search` subcommand, a parallel grep across a collected crashdump.
+
+It works on an extracted crashdump directory or an indexed archive. The
+files are grouped by the machine they were collected from, the groups are
+searched in parallel and the results are printed group by group.
+"""
+
+import argparse
+import fnmatch
+import gzip
+import multiprocessing
+import os
+import re
+import sys
+import zlib
+
+from jujucrashdump import archive
+
+# Machine directories created by extract_unit_tarball, relative to
+# the directory with juju_status.yaml: 0/baremetal, 0/lxd/1, 0/kvm/2, ...
+MACHINE_RE = re.compile(r"^\d+/(baremetal|[a-z]+/\d+)$")
+# The group for the files collected on the local host, e.g. debug_log.txt.
+MODEL_GROUP = "model"
+
+
+class DirectorySource(object):
+    """The files of an extracted crashdump."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def entries(self):
+        entries = {}
+        for root, dirs, files in os.walk(self.path):
+            for name in dirs + files:
+                full = os.path.join(root, name)
+                path = os.path.relpath(full, self.path)
+                if os.path.islink(full):
+                    entries[path] = {"type": "symlink", "target": os.readlink(full)}
+                elif os.path.isdir(full):
+                    entries[path] = {"type": "dir"}
+                elif os.path.isfile(full):
+                    entries[path] = {"type": "file"}
+        return entries
+
+    def lines(self, path):
+        path = os.path.join(self.path, path)
+        with (gzip.open if path.endswith(".gz") else open)(path, "rb") as fd:
+            for line in fd:
+                yield line
+
+
+class ArchiveSource(object):
+    """The files of an indexed crashdump archive."""
+
+    def __init__(self, path):
+        self.path = path
+        self.archive = archive.IndexedArchive(path)
+
+    def entries(self):
+        return self.archive.entries
+
+    def lines(self, path):
+        if path.endswith(".gz"):
+            return archive.split_lines(gunzip(self.archive.chunks(path)))
+        return self.archive.lines(path)
+
+
+def gunzip(chunks):
+    """Yield the decompressed data of the gzip file in chunks."""
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for data in chunks:
+        while data:
+            yield decompressor.decompress(data)
+            if not decompressor.eof:
+                break
+            # The next member of a multi member file, e.g. concatenated logs.
+            data = decompressor.unused_data
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+def open_source(path):
+    if os.path.isdir(path):
+        return DirectorySource(path)
+    if archive.is_archive(path):
+        return ArchiveSource(path)
+    raise archive.ArchiveError(
+        "%s is neither a crashdump directory nor an indexed archive, extract it "
+        "or collect it with --format indexed" % path
+    )
+
+
+def machine_groups(entries, machines=None, units=None):
+    """Group the files of a crashdump by machine.
+
+    Returns a sorted list of (group, prefix, [path, ...]), where the group is
+    the machine directory, e.g. 0/baremetal, or MODEL_GROUP for the files
+    collected on the local host. The groups can be limited to the given
+    machine ids, e.g. 0 or 0/lxd/1, and the machines hosting the given
+    units, which are found through the alias symlinks in the crashdump.
+    Groups of multi-model crashdumps are prefixed with the model directory.
+    """
+    roots = sorted(
+        os.path.dirname(path)
+        for path in entries
+        if os.path.basename(path) == "juju_status.yaml" and path.count("/") <= 2
+    )
+    if not roots:
+        roots = [""]
+    groups = {}
+    wanted = None
+    if machines or units:
+        wanted = set()
+    for root in roots:
+        prefix = root + "/" if root else ""
+        prefix_group = ""
+        if len(roots) > 1:
+            prefix_group = os.path.basename(root) + "/"
+        for machine in machines or []:
+            if "/" not in machine:
+                machine += "/baremetal"
+            wanted.add(prefix_group + machine)
+        for unit in units or []:
+            alias = entries.get(prefix + unit.replace("/", "_"))
+            if alias and alias["type"] == "symlink":
+                wanted.add(prefix_group + os.path.normpath(alias["target"]))
+        for path, entry in entries.items():
+            if entry["type"] != "dir" or not path.startswith(prefix):
+                continue
+            if MACHINE_RE.match(path[len(prefix):]):
+                groups[path + "/"] = prefix_group + path[len(prefix):]
+        groups[prefix] = prefix_group + MODEL_GROUP
+    files = {}
+    for path, entry in entries.items():
+        if entry["type"] != "file":
+            continue
+        # The longest matching prefix is the machine, or model, it belongs to.
+        owner = max((p for p in groups if path.startswith(p)), key=len, default=None)
+        if owner is not None:
+            files.setdefault(owner, []).append(path)
+    return sorted(
+        (
+            (groups[prefix], prefix, sorted(paths))
+            for prefix, paths in files.items()
+            if wanted is None or groups[prefix] in wanted
+        ),
+        key=lambda g: _group_key(g[0]),
+    )
+
+
+def _group_key(group):
+    # Sort machine 10 after machine 9, and the model group after the machines.
+    return [(0, int(p), "") if p.isdigit() else (1, 0, p) for p in group.split("/")]
+
+
+_source = None
+
+
+def _init_worker(path):
+    global _source
+    _source = open_source(path)
+
+
+def search_group(task):
+    """Search the files of one group, returning [(path, line number, line)].
+    The file globs are matched against the path within the machine."""
+    group, prefix, paths, pattern, flags, file_globs = task
+    regex = re.compile(pattern.encode("utf-8"), flags)
+    matches = []
+    for path in paths:
+        if file_globs and not any(
+            fnmatch.fnmatch(path[len(prefix):], g) for g in file_globs
+        ):
+            continue
+        try:
+            for number, line in enumerate(_source.lines(path), 1):
+                if regex.search(line):
+                    matches.append((path, number, line))
+        except (IOError, OSError, EOFError, zlib.error):
+            continue
+    return group, matches
+
+
+def search(
+    path, pattern, machines=None, units=None, files=None, ignore_case=False, jobs=None
+):
+    """Yield (group, [(path, line number, line)]) for every group with
+    matches, in group order, while the later groups are still searched."""
+    entries = open_source(path).entries()
+    flags = re.IGNORECASE if ignore_case else 0
+    # Fail on an invalid pattern here, rather than in every worker.
+    re.compile(pattern.encode("utf-8"), flags)
+    tasks = [
+        (group, prefix, paths, pattern, flags, files)
+        for group, prefix, paths in machine_groups(entries, machines, units)
+    ]
+    pool = multiprocessing.Pool(jobs, initializer=_init_worker, initargs=(path,))
+    try:
+        for group, matches in pool.imap(search_group, tasks):
+            if matches:
+                yield group, matches
+    finally:
+        pool.terminate()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="juju-crashdump search",
+        description="Search the files of a crashdump directory or indexed "
+        "archive, grouped by machine.",
+    )
+    parser.add_argument("pattern", help="A python regular expression")
+    parser.add_argument("path", help="A crashdump directory or indexed archive")
+    parser.add_argument(
+        "-m",
+        "--machine",
+        action="append",
+        help="Only search this machine, e.g. 0 or 0/lxd/1",
+    )
+    parser.add_argument(
+        "-u", "--unit", action="append", help="Only search the machine of this unit"
+    )
+    parser.add_argument(
+        "-f",
+        "--file",
+        action="append",
+        help="Only search files matching this glob, e.g. 'var/log/juju/*.log'",
+    )
+    parser.add_argument(
+        "-i", "--ignore-case", action="store_true", help="Ignore case distinctions"
+    )
+    parser.add_argument(
+        "-l",
+        "--files-with-matches",
+        action="store_true",
+        help="Only print the names of files with matches",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Number of processes to search with (default: number of CPUs)",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    opts = parse_args(argv)
+    out = sys.stdout.buffer
+    results = search(
+        opts.path,
+        opts.pattern,
+        machines=opts.machine,
+        units=opts.unit,
+        files=opts.file,
+        ignore_case=opts.ignore_case,
+        jobs=opts.jobs,
+    )
+    try:
+        for group, matches in results:
+            out.write(("== %s ==\n" % group).encode())
+            if opts.files_with_matches:
+                for path in sorted(set(m[0] for m in matches)):
+                    out.write(("%s\n" % path).encode())
+            else:
+                for path, number, line in matches:
+                    out.write(
+                        ("%s:%d:" % (path, number)).encode() + line.rstrip(b"\n")
+                    )
+                    out.write(b"\n")
+            out.flush()
+    except re.error as e:
+        archive.fail("juju-crashdump search", "invalid pattern %r: %s" % (opts.pattern, e))
+    except (archive.ArchiveError, FileNotFoundError) as e:
+        archive.fail("juju-crashdump search", e)
@@ -0,0 +1,185 @@
+"""Merge the logs of a crashdump into one time ordered timeline.
+
+Every line of the timeline is tagged with the machine and file it comes
+from. The logs are read line by line and merged with a heap, so memory use
+doesn't depend on their size. Timestamps are only parsed as far as needed to
+compare them: each is turned into a "YYYY-MM-DD HH:MM:SS" string. Lines
+without a timestamp, such as tracebacks, stay with the line before them.
+"""
+
+import argparse
+import fnmatch
+import gzip
+import heapq
+import os
+import re
+import shutil
+import tempfile
+import time
+
+from jujucrashdump import archive, search
+
+# Logs to merge, relative to the machine directory, or for the model group
+# to the directory with juju_status.yaml.
+TIMELINE_GLOBS = [
+    "debug_log.txt",
+    "debug_log.txt.gz",
+    "var/log/juju/*.log",
+    "var/log/syslog",
+    "var/log/kern.log",
+    "journalctl/*.log",
+]
+# Merge at most this many files at once, more are merged in batches first.
+MAX_OPEN = 256
+MONTHS = {
+    month: "%02d" % i
+    for i, month in enumerate(
+        "Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec".split(), 1
+    )
+}
+# Juju logs, debug-log lines ("machine-0: 2023-02-10 18:16:06 ...") and
+# rsyslog's high precision format.
+ISO_RE = re.compile(rb"^(?:\S+: )?(\d{4}-\d\d-\d\d)[ T](\d\d:\d\d:\d\d)")
+# Traditional syslog and journalctl: "Feb 10 18:16:06 host ...".
+SYSLOG_RE = re.compile(rb"^([A-Z][a-z]{2}) +(\d{1,2}) (\d\d:\d\d:\d\d) ")
+
+
+def timestamp(line, year):
+    """Return the timestamp of a log line as "YYYY-MM-DD HH:MM:SS", or None.
+
+    Syslog lines have no year, the year passed in is used for them."""
+    match = ISO_RE.match(line)
+    if match:
+        return (match.group(1) + b" " + match.group(2)).decode("ascii")
+    match = SYSLOG_RE.match(line)
+    if match and match.group(1).decode("ascii") in MONTHS:
+        return "%s-%s-%02d %s" % (
+            year,
+            MONTHS[match.group(1).decode("ascii")],
+            int(match.group(2)),
+            match.group(3).decode("ascii"),
+        )
+    return None
+
+
+def _open(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def records(path, source, since=None, until=None):
+    """Yield (timestamp, source, record) for the records of a log file in
+    the window, where a record is a line with a timestamp together with the
+    lines without one after it."""
+    year = time.gmtime(os.path.getmtime(path)).tm_year
+    key, record = None, []
+    with _open(path) as fd:
+        for line in fd:
+            line_key = timestamp(line, year)
+            if line_key is None:
+                if key is not None:
+                    record.append(line)
+                continue
+            if record and (since is None or key >= since):
+                yield key, source, b"".join(record)
+            if until is not None and line_key > until:
+                return
+            key, record = line_key, [line]
+    if record and (since is None or key >= since):
+        yield key, source, b"".join(record)
+
+
+def tagged(record):
+    key, source, text = record
+    lines = text.splitlines(True)
+    if not lines[-1].endswith(b"\n"):
+        lines[-1] += b"\n"
+    return b"".join(source.encode("utf-8") + b" | " + line for line in lines)
+
+
+def timeline_sources(path):
+    """Return the (file, source) of the logs of a crashdump directory."""
+    sources = []
+    entries = search.DirectorySource(path).entries()
+    for group, prefix, paths in search.machine_groups(entries):
+        for name in paths:
+            relative = name[len(prefix):]
+            if any(fnmatch.fnmatch(relative, g) for g in TIMELINE_GLOBS):
+                sources.append(
+                    (os.path.join(path, name), "%s:%s" % (group, relative))
+                )
+    return sources
+
+
+def _write_batch(streams, path):
+    # Partial timelines keep the parsed timestamps, as syslog lines can't be
+    # parsed again without knowing the year of the file they came from.
+    with gzip.open(path, "wb") as out:
+        for key, source, text in heapq.merge(*streams, key=lambda r: r[0]):
+            out.write(("%s\t%s\t%d\n" % (key, source, len(text))).encode("utf-8"))
+            out.write(text)
+
+
+def _read_batch(path):
+    with gzip.open(path, "rb") as fd:
+        for header in fd:
+            key, source, length = header.decode("utf-8").split("\t")
+            yield key, source, fd.read(int(length))
+
+
+def write_timeline(path, output, since=None, until=None):
+    """Merge the logs of the crashdump directory at path into output.
+
+    since and until limit the timeline to a window, as "YYYY-MM-DD HH:MM:SS"
+    or any prefix of it, e.g. "2023-02-10 18"."""
+    if until is not None:
+        # Make a prefix like "2023-02-10 18" include the whole hour.
+        until += "\xff"
+    streams = [records(f, s, since, until) for f, s in timeline_sources(path)]
+    batch_dir = tempfile.mkdtemp()
+    try:
+        # Keep the number of open files bounded by merging in batches.
+        while len(streams) > MAX_OPEN:
+            batches = []
+            for i in range(0, len(streams), MAX_OPEN):
+                batch = os.path.join(
+                    batch_dir, "batch-%d.gz" % len(os.listdir(batch_dir))
+                )
+                _write_batch(streams[i:i + MAX_OPEN], batch)
+                batches.append(_read_batch(batch))
+            streams = batches
+        with open(output, "wb") as out:
+            for record in heapq.merge(*streams, key=lambda r: r[0]):
+                out.write(tagged(record))
+    finally:
+        shutil.rmtree(batch_dir)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="juju-crashdump timeline",
+        description="Merge the logs of an extracted crashdump into one time "
+        "ordered file, each line tagged with the machine and file it is from.",
+    )
+    parser.add_argument("path", help="A crashdump directory")
+    parser.add_argument(
+        "-o", "--output", default="timeline.txt", help="(default: %(default)s)"
+    )
+    parser.add_argument(
+        "--since", help="Start of the window, as YYYY-MM-DD HH:MM:SS or a prefix"
+    )
+    parser.add_argument(
+        "--until", help="End of the window, as YYYY-MM-DD HH:MM:SS or a prefix"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    opts = parse_args(argv)
+    if not os.path.isdir(opts.path):
+        archive.fail(
+            "juju-crashdump timeline",
+            "%s is not a crashdump directory, extract it first" % opts.path,
+        )
+    write_timeline(opts.path, opts.output, opts.since, opts.until)
@@ -0,0 +1,208 @@
+"""A first look at a crashdump, written to summary.yaml and summary.txt.
+
+The unit logs are scanned while they are extracted from the unit tarballs,
+so nothing is read twice, for failed hooks, python tracebacks, OOM killer
+events and juju-db errors. Together with the units and machines in an
+error or blocked state, that is usually enough for a first response
+without unpacking the crashdump.
+"""
+
+import os
+import re
+import tarfile
+
+import yaml
+
+# Only the first findings of each kind are kept, with a count of the rest.
+MAX_FINDINGS = 50
+MAX_LINE = 300
+BUFFER_SIZE = 1024 * 1024
+# Files worth scanning, relative to the machine directory. The unit tarball
+# is created in the addon output directory, so the --journalctl logs and the
+# engine-report addon output are at its root.
+SCAN_RE = re.compile(
+    r"^(var/log|var/snap/juju-db/common/logs|journalctl|juju_introspection)/"
+)
+FINDINGS = [
+    # (kind, title, regex, only in files matching)
+    (
+        "failed-hooks",
+        "Failed hooks",
+        re.compile(rb'hook "[^"]+" (\(via [^)]*\) )?failed'),
+        None,
+    ),
+    (
+        "tracebacks",
+        "Python tracebacks",
+        re.compile(rb"Traceback \(most recent call last\):"),
+        None,
+    ),
+    (
+        "oom-kills",
+        "OOM killer events",
+        re.compile(rb"invoked oom-killer|Out of memory: Kill"),
+        None,
+    ),
+    (
+        "juju-db-errors",
+        "juju-db errors",
+        re.compile(rb'"s":"[EF]"|\s[EF]\s+[A-Z]+\s+\['),
+        re.compile(r"juju-db"),
+    ),
+]
+
+
+class FileScanner(object):
+    """Scans the contents of one file, fed in chunks of any size."""
+
+    def __init__(self, triage, path):
+        self.triage = triage
+        self.path = path
+        self.kinds = [
+            (kind, regex)
+            for kind, _, regex, only in FINDINGS
+            if only is None or only.search(path)
+        ]
+        self.rest = b""
+        self.number = 0
+
+    def feed(self, data):
+        lines = (self.rest + data).split(b"\n")
+        self.rest = lines.pop()
+        for line in lines:
+            self.scan(line)
+
+    def close(self):
+        if self.rest:
+            self.scan(self.rest)
+            self.rest = b""
+
+    def scan(self, line):
+        self.number += 1
+        for kind, regex in self.kinds:
+            if regex.search(line):
+                self.triage.add(kind, self.path, self.number, line)
+
+
+class Triage(object):
+    """Collects the findings of the scanned files."""
+
+    def __init__(self):
+        self.findings = {kind: [] for kind, _, _, _ in FINDINGS}
+        self.counts = {kind: 0 for kind, _, _, _ in FINDINGS}
+
+    def scanner(self, path):
+        return FileScanner(self, path)
+
+    def add(self, kind, path, number, line):
+        self.counts[kind] += 1
+        if len(self.findings[kind]) < MAX_FINDINGS:
+            text = line[:MAX_LINE].decode("utf-8", "replace").strip()
+            self.findings[kind].append(
+                {"file": path, "line": number, "text": text}
+            )
+
+    def update(self, other):
+        """Merge the findings of another Triage, e.g. from a worker process."""
+        for kind in self.findings:
+            self.counts[kind] += other.counts[kind]
+            room = MAX_FINDINGS - len(self.findings[kind])
+            self.findings[kind].extend(other.findings[kind][: max(room, 0)])
+
+
+def extract_and_scan(tarball, dest, base):
+    """Extract tarball into dest, scanning the files worth scanning on the
+    way. Findings refer to the files as base/<path in tarball>. Returns the
+    Triage."""
+    triage = Triage()
+    with tarfile.open(tarball, "r|") as tar:
+        for member in tar:
+            name = os.path.normpath(member.name)
+            if name.startswith("..") or os.path.isabs(name):
+                continue
+            if not member.isfile() or not SCAN_RE.match(name):
+                _extract(tar, member, dest)
+                continue
+            path = os.path.join(dest, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            scanner = triage.scanner(os.path.join(base, name))
+            src = tar.extractfile(member)
+            with open(path, "wb") as fd:
+                for data in iter(lambda: src.read(BUFFER_SIZE), b""):
+                    fd.write(data)
+                    scanner.feed(data)
+            scanner.close()
+            os.chmod(path, member.mode)
+            os.utime(path, (member.mtime, member.mtime))
+    return triage
+
+
+def _extract(tar, member, dest):
+    if hasattr(tarfile, "fully_trusted_filter"):
+        # The tarball is ours, keep permissions like tar -p would.
+        tar.extract(member, dest, filter="fully_trusted")
+    else:
+        tar.extract(member, dest)
+
+
+def status_findings(status):
+    """From a given juju_status.yaml dict return the units and machines in
+    an error or blocked state."""
+    out = []
+    for m_id, m_info in status.get("machines", {}).items():
+        machines = [(m_id, m_info)] + list(m_info.get("containers", {}).items())
+        for machine, info in machines:
+            for key in ("juju-status", "machine-status"):
+                current = info.get(key, {}).get("current")
+                if current in ("error", "down", "provisioning error"):
+                    out.append(
+                        {
+                            "machine": machine,
+                            "status": current,
+                            "message": info[key].get("message", ""),
+                        }
+                    )
+                    break
+    for a_info in status.get("applications", {}).values():
+        units = list(a_info.get("units", {}).items())
+        for _, u_info in list(units):
+            units.extend(u_info.get("subordinates", {}).items())
+        for unit, info in units:
+            for key in ("workload-status", "juju-status"):
+                current = info.get(key, {}).get("current")
+                if current in ("error", "blocked"):
+                    out.append(
+                        {
+                            "unit": unit,
+                            "status": current,
+                            "message": info[key].get("message", ""),
+                        }
+                    )
+                    break
+    return out
+
+
+def write_summary(status, triage, path="."):
+    """Write summary.yaml and summary.txt to path."""
+    summary = {"status": status_findings(status) if status else []}
+    for kind, _, _, _ in FINDINGS:
+        summary[kind] = {"count": triage.counts[kind], "found": triage.findings[kind]}
+    with open(os.path.join(path, "summary.yaml"), "w") as fd:
+        yaml.safe_dump(summary, fd, default_flow_style=False)
+    with open(os.path.join(path, "summary.txt"), "w") as fd:
+        fd.write("Units and machines in an error or blocked state:\n")
+        if not summary["status"]:
+            fd.write("  none\n")
+        for item in summary["status"]:
+            fd.write(
+                "  %s: %s %s\n"
+                % (item.get("unit", item.get("machine")), item["status"], item["message"])
+            )
+        for kind, title, _, _ in FINDINGS:
+            found = summary[kind]["found"]
+            fd.write("\n%s: %d\n" % (title, summary[kind]["count"]))
+            for finding in found:
+                fd.write("  %(file)s:%(line)d: %(text)s\n" % finding)
+            if summary[kind]["count"] > len(found):
+                fd.write("  ... and %d more\n" % (summary[kind]["count"] - len(found)))
@@ -0,0 +1,542 @@
+"""Chunked, resumable and parallel upload of crashdumps.
+
+A file is uploaded in chunks of CHUNK_SIZE bytes, jobs of them at a time,
+so memory use doesn't depend on its size and a failed chunk is retried on
+its own. A failed upload leaves <file>.upload.json behind, and running it
+again asks the backend which chunks it already has and only sends the rest:
+
+    juju-crashdump upload juju-crashdump-<uniq>.tar.xz --bug 1234567
+
+Backends:
+
+- LaunchpadBackend attaches the chunks to a bug as <name>.part0000, ...
+  without a comment, then adds one comment with the checksum and how to put
+  them together. It needs launchpadlib, and the user to be the reporter or
+  a subscriber of the bug.
+- DirectoryBackend puts the file together in a local directory, e.g. a
+  mounted share.
+- HTTPBackend PUTs the chunks to <url>/<name>/<index>, and POSTs the
+  manifest to <url>/<name>/complete once they are all there. A GET of
+  <url>/<name>/ returns the JSON list of the indexes of the chunks it has.
+
+The Uploader runs uploads in the background, so the unit tarballs can be
+uploaded as parts while the other machines are still being collected.
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import gzip
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+
+from jujucrashdump import retry
+
+CHUNK_SIZE = 32 * 1024 * 1024
+UPLOAD_JOBS = 4
+BUFFER_SIZE = 1024 * 1024
+# Next to the file being uploaded, to resume the upload.
+STATE_SUFFIX = ".upload.json"
+# Launchpad answers worth retrying, besides server errors.
+RETRY_STATUSES = (408, 429)
+# The launchpad credentials, shared by the upload threads, and by later runs.
+CREDENTIALS_FILE = os.path.join(
+    os.path.expanduser("~"), ".local/share/juju-crashdump/launchpad-credentials"
+)
+
+
+class UploadError(Exception):
+    pass
+
+
+def launchpad_available():
+    # Only look for launchpadlib, importing it takes long.
+    return importlib.util.find_spec("launchpadlib") is not None
+
+
+def manifest(path, name, chunk_size=CHUNK_SIZE):
+    """Return the manifest of the file at path, uploaded as name: its size
+    and the sha256 of the whole file and of each chunk."""
+    whole = hashlib.sha256()
+    chunks = []
+    with open(path, "rb") as fd:
+        for data in iter(lambda: fd.read(chunk_size), b""):
+            whole.update(data)
+            chunks.append(hashlib.sha256(data).hexdigest())
+    return {
+        "name": name,
+        "size": os.path.getsize(path),
+        "chunk_size": chunk_size,
+        "sha256": whole.hexdigest(),
+        "chunks": chunks,
+    }
+
+
+def _read_chunk(path, index, chunk_size):
+    with open(path, "rb") as fd:
+        fd.seek(index * chunk_size)
+        return fd.read(chunk_size)
+
+
+class DirectoryBackend(object):
+    """Puts uploaded files together in a local directory."""
+
+    def __init__(self, path):
+        self.path = path
+        self.key = "dir:%s" % os.path.abspath(path)
+
+    def _parts(self, upload_id):
+        return os.path.join(self.path, upload_id + ".parts")
+
+    def start(self, name):
+        if not os.path.isdir(self._parts(name)):
+            os.makedirs(self._parts(name))
+        return name
+
+    def uploaded(self, upload_id):
+        if not os.path.isdir(self._parts(upload_id)):
+            return set()
+        return {int(n) for n in os.listdir(self._parts(upload_id)) if n.isdigit()}
+
+    def put_chunk(self, upload_id, index, data):
+        path = os.path.join(self._parts(upload_id), "%06d" % index)
+        with open(path + ".tmp", "wb") as fd:
+            fd.write(data)
+        os.rename(path + ".tmp", path)
+
+    def finish(self, upload_id, manifest):
+        parts = self._parts(upload_id)
+        path = os.path.join(self.path, manifest["name"])
+        whole = hashlib.sha256()
+        with open(path + ".tmp", "wb") as out:
+            for index in range(len(manifest["chunks"])):
+                with open(os.path.join(parts, "%06d" % index), "rb") as fd:
+                    for data in iter(lambda: fd.read(BUFFER_SIZE), b""):
+                        whole.update(data)
+                        out.write(data)
+        if whole.hexdigest() != manifest["sha256"]:
+            os.remove(path + ".tmp")
+            raise UploadError("Checksum mismatch putting %s together" % path)
+        os.rename(path + ".tmp", path)
+        shutil.rmtree(parts)
+        return path
+
+
+class HTTPBackend(object):
+    """Uploads the chunks to an HTTP server, see the module docstring."""
+
+    def __init__(self, url, timeout=300):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.key = "http:%s" % self.url
+
+    def _request(self, path, data=None, method="GET", headers=None):
+        request = urllib.request.Request(
+            "%s/%s" % (self.url, path), data=data, method=method, headers=headers or {}
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return response.read()
+
+    def start(self, name):
+        return name
+
+    def uploaded(self, upload_id):
+        try:
+            return set(json.loads(self._request(upload_id + "/").decode("utf-8")))
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return set()
+            raise
+        except ValueError as e:
+            raise UploadError("Unexpected chunk list from %s: %s" % (self.url, e))
+
+    def put_chunk(self, upload_id, index, data):
+        self._request(
+            "%s/%06d" % (upload_id, index),
+            data,
+            "PUT",
+            {"X-Chunk-Sha256": hashlib.sha256(data).hexdigest()},
+        )
+
+    def finish(self, upload_id, manifest):
+        self._request(
+            upload_id + "/complete",
+            json.dumps(manifest).encode("utf-8"),
+            "POST",
+            {"Content-Type": "application/json"},
+        )
+        return "%s/%s" % (self.url, upload_id)
+
+
+class LaunchpadBackend(object):
+    """Attaches the chunks to a launchpad bug."""
+
+    def __init__(self, bug, service_root="production", credentials_file=None):
+        self.bug = bug
+        self.service_root = service_root
+        self.credentials_file = credentials_file or CREDENTIALS_FILE
+        self.key = "lp:%s" % bug
+        # launchpadlib objects aren't thread safe, each thread logs in.
+        self._local = threading.local()
+        self._login_lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def _errors(self):
+        # launchpadlib raises lazr.restfulclient errors, turn them into an
+        # IOError to retry, or an UploadError.
+        from lazr.restfulclient.errors import HTTPError
+
+        try:
+            yield
+        except HTTPError as e:
+            status = e.response.status
+            message = "launchpad bug %s: HTTP %s %s" % (
+                self.bug,
+                status,
+                getattr(e.response, "reason", ""),
+            )
+            if status >= 500 or status in RETRY_STATUSES:
+                raise IOError(message)
+            raise UploadError(message)
+
+    def _bug(self):
+        if not hasattr(self._local, "bug"):
+            from launchpadlib.launchpad import Launchpad
+
+            # The first login, from start(), authorizes and saves the
+            # credentials, the other threads reuse them rather than each
+            # asking in the browser when there is no keyring.
+            with self._login_lock:
+                directory = os.path.dirname(self.credentials_file)
+                if not os.path.isdir(directory):
+                    os.makedirs(directory, 0o700)
+                self._local.launchpad = Launchpad.login_with(
+                    "juju-crashdump",
+                    self.service_root,
+                    credentials_file=self.credentials_file,
+                    version="devel",
+                )
+            self._local.bug = self._local.launchpad.bugs[self.bug]
+        return self._local.bug
+
+    @staticmethod
+    def _filename(upload_id, index):
+        return "%s.part%04d" % (upload_id, index)
+
+    def start(self, name):
+        with self._errors():
+            bug = self._bug()
+            if bug.duplicate_of is not None:
+                raise UploadError(
+                    "Bug %s is a duplicate of bug %s" % (self.bug, bug.duplicate_of.id)
+                )
+            # Like apport, only the reporter and subscribers add to a bug.
+            me = self._local.launchpad.me.self_link
+            subscribers = {s.person_link for s in bug.subscriptions}
+            if bug.owner_link != me and me not in subscribers:
+                raise UploadError(
+                    "You are not the reporter or a subscriber of bug %s, subscribe "
+                    "to it or create a new report on "
+                    "https://bugs.launchpad.net/charms" % self.bug
+                )
+        return name
+
+    def uploaded(self, upload_id):
+        with self._errors():
+            names = {a.title for a in self._bug().attachments}
+        return {
+            index
+            for index in range(10000)
+            if self._filename(upload_id, index) in names
+        }
+
+    def put_chunk(self, upload_id, index, data):
+        with self._errors():
+            # Every attachment belongs to a message, keep it empty rather
+            # than a comment per chunk, finish comments once.
+            self._bug().addAttachment(
+                comment="",
+                data=data,
+                description=self._filename(upload_id, index),
+                filename=self._filename(upload_id, index),
+                is_patch=False,
+            )
+
+    def finish(self, upload_id, manifest):
+        parts = [self._filename(upload_id, i) for i in range(len(manifest["chunks"]))]
+        with self._errors():
+            self._bug().newMessage(
+                subject="juju crashdump %s" % manifest["name"],
+                content="juju crashdump %s, %d bytes, sha256 %s, attached in %d "
+                "parts:\n\ncat %s > %s\n"
+                % (
+                    manifest["name"],
+                    manifest["size"],
+                    manifest["sha256"],
+                    len(parts),
+                    " ".join(parts),
+                    manifest["name"],
+                ),
+            )
+        return "lp:%s" % self.bug
+
+
+def _load_state(state_path, backend, path, chunk_size):
+    try:
+        with open(state_path) as fd:
+            state = json.load(fd)
+    except (IOError, ValueError):
+        return None
+    if (
+        state.get("backend") != backend.key
+        or state.get("mtime") != os.path.getmtime(path)
+        or state["manifest"]["size"] != os.path.getsize(path)
+        or state["manifest"]["chunk_size"] != chunk_size
+    ):
+        return None
+    return state
+
+
+def upload(
+    path,
+    backend,
+    name=None,
+    chunk_size=CHUNK_SIZE,
+    jobs=UPLOAD_JOBS,
+    executor=None,
+    budget=None,
+):
+    """Upload the file at path to backend as name, jobs chunks at a time, or
+    on executor if given. Resumes an earlier upload of the same file to the
+    same backend. Returns where it was uploaded to, raises UploadError if it
+    failed, then it can be resumed."""
+    name = name or os.path.basename(path)
+    state_path = path + STATE_SUFFIX
+    state = _load_state(state_path, backend, path, chunk_size)
+    if state is None:
+        if not os.path.isfile(path):
+            raise UploadError("%s is not a file" % path)
+        # Before hashing the file, the backend may refuse it.
+        upload_id = backend.start(name)
+        info = manifest(path, name, chunk_size)
+        state = {
+            "backend": backend.key,
+            "mtime": os.path.getmtime(path),
+            "manifest": info,
+            "upload_id": upload_id,
+        }
+        with open(state_path, "w") as fd:
+            json.dump(state, fd)
+        todo = list(range(len(info["chunks"])))
+    else:
+        # Only trust what the backend has for an upload of this very file.
+        info = state["manifest"]
+        todo = sorted(
+            set(range(len(info["chunks"]))) - backend.uploaded(state["upload_id"])
+        )
+        logging.info(
+            "Resuming the upload of %s, %d of %d chunks to go."
+            % (path, len(todo), len(info["chunks"]))
+        )
+    upload_id = state["upload_id"]
+    if budget is None:
+        budget = retry.ErrorBudget()
+
+    def put(index):
+        data = _read_chunk(path, index, chunk_size)
+        if hashlib.sha256(data).hexdigest() != info["chunks"][index]:
+            raise UploadError("%s changed while it was uploaded" % path)
+
+        def attempt():
+            try:
+                backend.put_chunk(upload_id, index, data)
+            except (IOError, OSError) as e:
+                logging.warning("Uploading chunk %d of %s failed: %s" % (index, path, e))
+                return False
+            return True
+
+        return retry.retry(
+            attempt, retry.TRANSFER, budget, "Uploading chunk %d of %s" % (index, path)
+        )
+
+    own_executor = executor is None
+    if own_executor:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+    try:
+        results = [executor.submit(put, index) for index in todo]
+        failed = [index for index, r in zip(todo, results) if not r.result()]
+    finally:
+        if own_executor:
+            executor.shutdown()
+    if failed:
+        raise UploadError(
+            "%d of %d chunks of %s failed to upload"
+            % (len(failed), len(info["chunks"]), path)
+        )
+    location = backend.finish(upload_id, info)
+    os.remove(state_path)
+    return location
+
+
+class Uploader(object):
+    """Uploads files in the background, at most jobs chunks at a time over
+    all of them."""
+
+    def __init__(
+        self,
+        backend,
+        jobs=UPLOAD_JOBS,
+        chunk_size=CHUNK_SIZE,
+        staging_dir=None,
+        keep_dir=None,
+    ):
+        self.backend = backend
+        self.chunk_size = chunk_size
+        self.budget = retry.ErrorBudget()
+        # Where parts are put while they are uploaded, created when needed
+        # in staging_dir.
+        self.staging_dir = staging_dir
+        self.staging = None
+        # Where parts that failed to upload are kept, with their state, so
+        # the upload can be resumed.
+        self.keep_dir = os.path.abspath(keep_dir or ".")
+        # {submitted path: kept path} of the parts that failed.
+        self._kept = {}
+        self._chunks = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+        # Compressing and hashing the files, before their chunks are queued.
+        self._files = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+        self._uploads = []
+
+    def part_path(self, name):
+        """Return where to put a file to submit as a part, it is removed
+        again once it is uploaded."""
+        if self.staging is None:
+            self.staging = tempfile.mkdtemp(
+                prefix="juju-crashdump-upload-", dir=self.staging_dir
+            )
+        return os.path.join(self.staging, name)
+
+    def _staged(self, path):
+        return self.staging is not None and path.startswith(self.staging)
+
+    def _keep(self, path):
+        # Move a part and its state out of the staging directory.
+        kept = os.path.join(self.keep_dir, os.path.basename(path))
+        for suffix in ("", STATE_SUFFIX):
+            if os.path.exists(path + suffix):
+                shutil.move(path + suffix, kept + suffix)
+        return kept
+
+    def _upload(self, path, name, compress):
+        submitted = path
+        try:
+            if compress:
+                with open(path, "rb") as src, gzip.open(path + ".gz", "wb") as dst:
+                    shutil.copyfileobj(src, dst, BUFFER_SIZE)
+                os.remove(path)
+                path, name = path + ".gz", name + ".gz"
+            location = upload(
+                path,
+                self.backend,
+                name,
+                self.chunk_size,
+                executor=self._chunks,
+                budget=self.budget,
+            )
+        except BaseException:
+            if self._staged(path):
+                self._kept[submitted] = self._keep(path)
+            raise
+        if self._staged(path):
+            os.remove(path)
+        return location
+
+    def submit(self, path, name=None, compress=False):
+        """Upload the file at path as name, gzip compressed if asked."""
+        name = name or os.path.basename(path)
+        logging.info("Uploading %s" % name)
+        self._uploads.append(
+            (name, path, self._files.submit(self._upload, path, name, compress))
+        )
+
+    def wait(self):
+        """Wait for the uploads, return the paths of the files that failed,
+        to resume their upload with."""
+        failed = []
+        try:
+            for name, path, future in self._uploads:
+                try:
+                    logging.info("Uploaded %s to %s" % (name, future.result()))
+                except (UploadError, IOError, OSError) as e:
+                    logging.warning("Uploading %s failed: %s" % (name, e))
+                    failed.append(self._kept.get(path, path))
+        finally:
+            self._files.shutdown()
+            self._chunks.shutdown()
+            if self.staging:
+                shutil.rmtree(self.staging)
+        return failed
+
+
+def add_backend_arguments(parser):
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument(
+        "-b", "--bug", default=None, help="Upload to the given launchpad bug #"
+    )
+    group.add_argument("--upload-dir", help="Upload to this local directory")
+    group.add_argument("--upload-url", help="Upload to this HTTP endpoint")
+
+
+def backend_from_args(opts):
+    """Return the backend chosen by the add_backend_arguments options."""
+    if opts.bug:
+        return LaunchpadBackend(opts.bug)
+    if opts.upload_dir:
+        return DirectoryBackend(opts.upload_dir)
+    if opts.upload_url:
+        return HTTPBackend(opts.upload_url)
+    return None
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        prog="juju-crashdump upload",
+        description="Upload a crashdump, or resume an upload that failed.",
+    )
+    parser.add_argument("path", help="The file to upload")
+    parser.add_argument("--name", help="Upload it under this name")
+    add_backend_arguments(parser)
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=UPLOAD_JOBS, help="(default: %(default)s)"
+    )
+    parser.add_argument(
+        "--chunk-size", type=int, default=CHUNK_SIZE, help="(default: %(default)s)"
+    )
+    opts = parser.parse_args(argv)
+    if not (opts.bug or opts.upload_dir or opts.upload_url):
+        parser.error("one of --bug, --upload-dir or --upload-url is required")
+    return opts
+
+
+def main(argv=None):
+    logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
+    opts = parse_args(argv)
+    try:
+        location = upload(
+            opts.path, backend_from_args(opts), opts.name, opts.chunk_size, opts.jobs
+        )
+    except (UploadError, IOError, OSError) as e:
+        logging.error("Uploading %s failed: %s" % (opts.path, e))
+        if os.path.exists(opts.path + STATE_SUFFIX):
+            logging.error("Run the same command again to resume the upload.")
+        sys.exit(1)
+    logging.info("Uploaded %s to %s" % (opts.path, location))
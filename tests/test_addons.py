@@ -0,0 +1,200 @@
+# Copyright 2023 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import mock
+
+from unittest import TestCase
+
+import jujucrashdump.addons as addons
+
+
+class TestArtifactCache(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache = addons.ArtifactCache(self.path, max_entries=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _build(self, name, command):
+        bundle = os.path.join(self.path, "build.tar.gz")
+        self.assertTrue(addons.build_bundle(command, bundle))
+        return self.cache.put(name, command, bundle)
+
+    def test_build_bundle(self):
+        bundle = self._build("example", "mkdir tool; echo hi > tool/run.sh")
+        with tarfile.open(bundle) as tar:
+            self.assertEqual(sorted(tar.getnames()), ["tool", "tool/run.sh"])
+
+    def test_build_bundle_failure(self):
+        bundle = os.path.join(self.path, "build.tar.gz")
+        self.assertFalse(addons.build_bundle("false", bundle))
+        self.assertFalse(os.path.exists(bundle))
+
+    def test_get(self):
+        self.assertIsNone(self.cache.get("example", "touch a"))
+        bundle = self._build("example", "touch a")
+        self.assertEqual(self.cache.get("example", "touch a"), bundle)
+        # A changed definition is a different entry.
+        self.assertIsNone(self.cache.get("example", "touch b"))
+        self.assertIsNone(self.cache.get("other", "touch a"))
+
+    def test_get_expired(self):
+        bundle = self._build("example", "touch a")
+        os.utime(bundle, (0, 0))
+        self.assertIsNone(self.cache.get("example", "touch a"))
+        # Kept until a rebuild replaces it.
+        self.assertEqual(self.cache.get_expired("example", "touch a"), bundle)
+
+    def test_evict(self):
+        now = time.time()
+        first = self._build("first", "touch a")
+        os.utime(first, (now - 20, now - 20))
+        second = self._build("second", "touch a")
+        os.utime(second, (now - 10, now - 10))
+        # Using the first entry makes the second the least recently used.
+        self.cache.get("first", "touch a")
+        self._build("third", "touch a")
+        self.assertTrue(os.path.exists(first))
+        self.assertFalse(os.path.exists(second))
+
+
+class TestCrashdumpAddon(TestCase):
+    @mock.patch.object(addons, "async_commands")
+    def test_local_cached(self, async_commands):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        addon = addons.CrashdumpAddon(
+            "tool", {"local-cached": "touch a"}, addons.ArtifactCache(path)
+        )
+        context = {"location": "/tmp/uniq/addons", "output": "/tmp/uniq/out"}
+        machines = [{"machine": "0"}]
+        with mock.patch.object(addons, "build_bundle", wraps=addons.build_bundle) as b:
+            addon.run(machines, [], context)
+            addon.run(machines, [], context)
+            self.assertEqual(b.call_count, 1)
+        bundle = addon.cache.get("tool", "touch a")
+        async_commands.assert_any_call(
+            "juju scp --proxy -- %s {machine}:/tmp/uniq/addons/tool.tar.gz" % bundle,
+            machines,
+        )
+        async_commands.assert_any_call(
+            'juju ssh --proxy {machine} "tar -xzf /tmp/uniq/addons/tool.tar.gz'
+            ' -C /tmp/uniq/addons; rm -f /tmp/uniq/addons/tool.tar.gz"',
+            machines,
+        )
+
+    @mock.patch.object(addons, "async_commands")
+    def test_local_cached_expired_offline(self, async_commands):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        cache = addons.ArtifactCache(path)
+        addon = addons.CrashdumpAddon("tool", {"local-cached": "touch a"}, cache)
+        context = {"location": "/tmp/uniq/addons", "output": "/tmp/uniq/out"}
+        machines = [{"machine": "0"}]
+        addon.run(machines, [], context)
+        bundle = cache.bundle_path("tool", "touch a")
+        os.utime(bundle, (0, 0))
+        # Rebuilding fails, e.g. without network access, the expired bundle
+        # is pushed instead.
+        with mock.patch.object(addons, "build_bundle", return_value=False):
+            addon.run(machines, [], context)
+        self.assertTrue(os.path.exists(bundle))
+        self.assertEqual(async_commands.call_count, 4)
+
+
+class TestPayloadDistribution(TestCase):
+    def test_plan_wave(self):
+        holders = [{"machine": "0", "zone": "a"}, {"machine": "5", "zone": "b"}]
+        pending = [{"machine": str(i), "zone": "a"} for i in range(1, 5)]
+        pending.append({"machine": "6", "zone": "b"})
+        wave = addons.plan_wave(holders, pending, fanout=2)
+        self.assertEqual(
+            [(w["src"]["machine"], w["dst"]["machine"]) for w in wave],
+            [("0", "1"), ("0", "2"), ("5", "6")],
+        )
+        self.assertEqual([p["machine"] for p in pending], ["3", "4"])
+
+    @mock.patch.object(addons, "async_commands")
+    def test_push_zone(self, async_commands):
+        async_commands.return_value = []
+        distribution = addons.PayloadDistribution(
+            "zone",
+            addresses={str(i): "10.0.0.%d" % i for i in range(4)},
+            zones={"0": "a", "1": "a", "2": "b", "3": "a"},
+            fanout=1,
+        )
+        machines = [{"machine": str(i)} for i in range(4)]
+        distribution.push("tool.tar.gz", "/tmp/u/addons/tool.tar.gz", machines)
+        calls = async_commands.call_args_list
+        # One upload per zone, then two relay waves within zone a.
+        self.assertEqual(len(calls), 3)
+        self.assertEqual([c["machine"] for c in calls[0][0][1]], ["0", "2"])
+        self.assertIn("ubuntu@{dst[address]}", calls[1][0][0])
+        self.assertEqual(
+            [(w["src"]["machine"], w["dst"]["machine"]) for w in calls[1][0][1]],
+            [("0", "1")],
+        )
+        self.assertEqual(
+            [(w["src"]["machine"], w["dst"]["machine"]) for w in calls[2][0][1]],
+            [("1", "3")],
+        )
+
+    @mock.patch.object(addons, "async_commands")
+    def test_push_controller_fallback(self, async_commands):
+        # The controller upload fails, so everything is pushed directly.
+        async_commands.side_effect = lambda cmd, contexts: (
+            contexts if cmd.startswith("juju scp {model}") else []
+        )
+        distribution = addons.PayloadDistribution(
+            "controller", addresses={"0": "10.0.0.1"}, controllers=["0"]
+        )
+        distribution.push("tool.tar.gz", "/tmp/u/addons/tool.tar.gz", [{"machine": "0"}])
+        async_commands.assert_called_with(
+            "juju scp --proxy -- tool.tar.gz {machine}:/tmp/u/addons/tool.tar.gz",
+            [{"machine": "0"}],
+        )
+
+    @mock.patch.object(addons, "async_commands")
+    def test_push_controller_of_target(self, async_commands):
+        async_commands.return_value = []
+        distribution = addons.PayloadDistribution(
+            "controller",
+            addresses={"0": "10.0.0.1"},
+            controllers=["0"],
+            controller_model="other:controller",
+        )
+        distribution.push("tool.tar.gz", "/tmp/u/addons/tool.tar.gz", [{"machine": "0"}])
+        self.assertEqual(
+            async_commands.call_args_list[1][0][1][0]["model"], "-m other:controller "
+        )
+
+    @mock.patch.object(addons, "async_commands")
+    def test_push_controller_cleanup(self, async_commands):
+        async_commands.return_value = []
+        distribution = addons.PayloadDistribution(
+            "controller", addresses={"0": "10.0.0.1"}, controllers=["0"]
+        )
+        distribution.push("tool.tar.gz", "/tmp/u/addons/tool.tar.gz", [{"machine": "0"}])
+        # The bundle and the directories made for it go from the controller.
+        async_commands.assert_any_call(
+            'juju ssh {model}--proxy {machine} "rm -f /tmp/u/addons/tool.tar.gz; '
+            'rmdir /tmp/u/addons /tmp/u 2>/dev/null; true"',
+            [{"machine": "0", "model": "-m controller ", "zone": None}],
+        )
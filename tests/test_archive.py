@@ -0,0 +1,110 @@
+# Copyright 2023 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+import shutil
+import tempfile
+import mock
+
+from unittest import TestCase
+
+import jujucrashdump.archive as archive
+
+
+class TestIndexedArchive(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.src = os.path.join(self.path, "src")
+        log_dir = os.path.join(self.src, "uniq", "0", "baremetal", "var", "log", "juju")
+        os.makedirs(log_dir)
+        with open(os.path.join(log_dir, "unit-app-0.log"), "wb") as fd:
+            fd.write(b"line one\nERROR line two\nline three")
+        with open(os.path.join(self.src, "uniq", "juju_status.yaml"), "wb") as fd:
+            fd.write(b"model: {}\n")
+        os.symlink("0/baremetal", os.path.join(self.src, "uniq", "app_0"))
+        self.archive_path = os.path.join(self.path, "dump.jcd")
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _open(self, codec="xz"):
+        archive.write_archive(self.src, self.archive_path, codec)
+        return archive.IndexedArchive(self.archive_path)
+
+    def test_read(self):
+        for codec in archive.CODECS:
+            with self._open(codec) as dump:
+                self.assertEqual(
+                    dump.read("uniq/0/baremetal/var/log/juju/unit-app-0.log"),
+                    b"line one\nERROR line two\nline three",
+                )
+
+    def test_chunks(self):
+        with mock.patch.object(archive, "CHUNK_SIZE", 4):
+            dump = self._open()
+        path = "uniq/juju_status.yaml"
+        self.assertEqual(len(dump.entries[path]["chunks"]), 3)
+        self.assertEqual(dump.read(path), b"model: {}\n")
+        dump.close()
+
+    def test_resolve_symlink(self):
+        with self._open() as dump:
+            self.assertEqual(dump.entries["uniq/app_0"]["type"], "symlink")
+            self.assertEqual(
+                list(dump.lines("uniq/app_0/var/log/juju/unit-app-0.log")),
+                [b"line one\n", b"ERROR line two\n", b"line three"],
+            )
+            self.assertRaises(KeyError, dump.resolve, "uniq/app_1/var")
+
+    def test_not_an_archive(self):
+        with open(self.archive_path, "wb") as fd:
+            fd.write(b"\xfd7zXZ\x00")
+        self.assertRaises(archive.ArchiveError, archive.IndexedArchive, self.archive_path)
+
+    def _main(self, *argv):
+        stdout = mock.Mock(buffer=io.BytesIO())
+        with mock.patch.object(archive.sys, "stdout", stdout):
+            archive.main(list(argv))
+        return stdout.buffer.getvalue()
+
+    def test_main(self):
+        archive.write_archive(self.src, self.archive_path)
+        self.assertEqual(
+            self._main("list", self.archive_path, "*.log"),
+            b"uniq/0/baremetal/var/log/juju/unit-app-0.log\n",
+        )
+        self.assertEqual(
+            self._main("cat", self.archive_path, "uniq/juju_status.yaml"),
+            b"model: {}\n",
+        )
+        self.assertEqual(
+            self._main("grep", "^ERROR", self.archive_path),
+            b"uniq/0/baremetal/var/log/juju/unit-app-0.log:2:ERROR line two\n",
+        )
+
+    def test_main_errors(self):
+        archive.write_archive(self.src, self.archive_path)
+        for argv, error in [
+            (("cat", self.archive_path, "uniq/nope"), "uniq/nope: no such file"),
+            (("cat", self.archive_path, "uniq/0"), "uniq/0 is not a file"),
+            (("grep", "(", self.archive_path), "invalid pattern '('"),
+        ]:
+            stderr = io.StringIO()
+            with mock.patch.object(archive.sys, "stderr", stderr):
+                with self.assertRaises(SystemExit) as cm:
+                    self._main(*argv)
+            self.assertEqual(cm.exception.code, 1)
+            self.assertIn(error, stderr.getvalue())
+            self.assertEqual(len(stderr.getvalue().splitlines()), 1)
@@ -0,0 +1,84 @@
+# Copyright 2023 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import os
+import shutil
+import tempfile
+import yaml
+import mock
+
+from unittest import TestCase
+
+import jujucrashdump.debuglog as debuglog
+
+ASSETS_PATH = os.path.join(os.path.dirname(__file__), "assets")
+
+PARTS = [
+    b"machine-0: 2023-01-01 10:00:00 INFO juju.worker started\n"
+    b"machine-0: 2023-01-01 10:00:02 ERROR juju.worker failed\n"
+    b"Traceback (most recent call last):\n"
+    b"  oops\n",
+    b"unit-app-0: 2023-01-01 10:00:01 INFO juju.worker.uniter hook\n"
+    b"unit-app-0: 2023-01-01 10:00:03 INFO juju.worker.uniter done\n",
+]
+
+
+class TestDebugLog(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_entities(self):
+        with open(os.path.join(ASSETS_PATH, "bad_juju_status.yaml")) as fd:
+            tags = debuglog.entities(yaml.safe_load(fd))
+        self.assertIn("machine-0-lxd-4", tags)
+        self.assertIn("unit-magpie-1", tags)
+
+    def test_queries(self):
+        self.assertEqual(
+            debuglog.queries(["machine-0", "unit-a-0", "unit-b-0"], 2),
+            [
+                ["--include", "machine-0", "--include", "unit-b-0"],
+                ["--include", "unit-a-0"],
+                ["--exclude", "machine-0", "--exclude", "unit-a-0", "--exclude", "unit-b-0"],
+            ],
+        )
+
+    def _fake_fetch(self, args, path):
+        index = 0 if "machine-0" in args[:2] else 1
+        with gzip.open(path, "wb") as fd:
+            fd.write(PARTS[index] if args[0] == "--include" else b"")
+        return True
+
+    def test_collect_debuglog(self):
+        status = {
+            "machines": {"0": {}},
+            "applications": {"app": {"units": {"app/0": {}}}},
+        }
+        path = os.path.join(self.path, "debug_log.txt.gz")
+        with mock.patch.object(debuglog, "fetch", side_effect=self._fake_fetch):
+            self.assertTrue(debuglog.collect_debuglog(status, path, jobs=2))
+        with gzip.open(path, "rb") as fd:
+            lines = fd.read().splitlines()
+        records = [line for line in lines if debuglog.RECORD_RE.match(line)]
+        self.assertEqual(
+            [line.split(b" ")[2] for line in records],
+            [b"10:00:00", b"10:00:01", b"10:00:02", b"10:00:03"],
+        )
+        # The traceback stays with its record.
+        self.assertEqual(lines[3], b"Traceback (most recent call last):")
+        self.assertEqual(os.listdir(self.path), ["debug_log.txt.gz"])
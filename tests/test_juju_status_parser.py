@@ -1,4 +1,6 @@
 import os
+import subprocess
+import mock
 import yaml
 from collections import defaultdict
 from unittest import TestCase
@@ -45,3 +47,72 @@ class TestJujuStatusParser(TestCase):
             "0/lxd/2": set(["postgresql/0", "10.245.214.4"]),
         }
         self.__check_status("bad_juju_status.yaml", mapping)
+
+    def test_machine_addresses(self):
+        with open(os.path.join(ASSETS_PATH, "bad_juju_status.yaml")) as fd:
+            addresses = crashdump.machine_addresses(yaml.safe_load(fd))
+        self.assertEqual(addresses["1"], ("10.245.214.28", "default"))
+        self.assertEqual(addresses["0/lxd/4"], ("10.245.214.27", "default"))
+
+    def test_shared_machines(self):
+        with open(os.path.join(ASSETS_PATH, "good_juju_status.yaml")) as fd:
+            good = yaml.safe_load(fd)
+        with open(os.path.join(ASSETS_PATH, "bad_juju_status.yaml")) as fd:
+            bad = yaml.safe_load(fd)
+        shared = crashdump.shared_machines(
+            [("a", good), ("b", bad), ("c", good)]
+        )
+        self.assertEqual(shared["a"], set())
+        self.assertEqual(shared["b"], set())
+        self.assertEqual(shared["c"], set(good["machines"]))
+
+    def test_shared_machines_same_model(self):
+        status = {
+            "machines": {
+                "0": {"dns-name": "10.0.0.1", "ip-addresses": ["10.0.0.1", "172.17.0.1"]},
+                "1": {"dns-name": "10.0.0.2", "ip-addresses": ["10.0.0.2", "172.17.0.1"]},
+            }
+        }
+        shared = crashdump.shared_machines([("only", status), ("other", status)])
+        self.assertEqual(shared["only"], set())
+        self.assertEqual(shared["other"], set(["0", "1"]))
+
+    def test_shared_machines_bridge_address(self):
+        # virbr0 has the same address on unrelated hosts.
+        openstack = {
+            "machines": {
+                "0": {
+                    "dns-name": "10.0.0.1",
+                    "instance-id": "node-a",
+                    "ip-addresses": ["10.0.0.1", "192.168.122.1"],
+                }
+            }
+        }
+        k8s = {
+            "machines": {
+                "0": {
+                    "dns-name": "10.0.1.5",
+                    "instance-id": "node-b",
+                    "ip-addresses": ["10.0.1.5", "192.168.122.1"],
+                }
+            }
+        }
+        shared = crashdump.shared_machines([("openstack", openstack), ("k8s", k8s)])
+        self.assertEqual(shared, {"openstack": set(), "k8s": set()})
+
+    def test_model_directory(self):
+        self.assertEqual(crashdump.model_directory("k8s"), "k8s")
+        self.assertEqual(crashdump.model_directory("ctrl:admin/k8s"), "ctrl_admin_k8s")
+
+    @mock.patch.object(crashdump, "model_status")
+    def test_model_statuses(self, model_status):
+        def status(model):
+            if model == "typo":
+                raise subprocess.CalledProcessError(1, "juju status")
+            return {"machines": {}}
+
+        model_status.side_effect = status
+        self.assertEqual(
+            crashdump.model_statuses(["a", "typo", "c:b"]),
+            [("a", {"machines": {}}), ("c:b", {"machines": {}})],
+        )
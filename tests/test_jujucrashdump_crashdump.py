@@ -12,6 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import gzip
+import json
+import os
+import shutil
+import tempfile
 import mock
 
 from unittest import TestCase
@@ -57,3 +62,331 @@ class TestCrashCollector(TestCase):
         self._run_all.assert_called_with(
             "mkdir -p /tmp/fake-uuid/addon_output; cd /tmp/fake-uuid/addon_output; find extra_dir /var/lib/lxd/containers/*/rootfsextra_dir . -mount -type f -size -42c -o -size 42c 2>/dev/null | tar -pcf ../juju-dump-fake-uuid.tar --exclude exc0 --exclude exc1 --files-from - 2>/dev/null"
         )
+
+    def test_create_unit_tarballs_redact(self):
+        self.target.uniq = "fake-uuid"
+        self.target.redact = []
+        self.patch_target("_run_all")
+        self.patch_target("_push_all")
+        self.target.create_unit_tarballs()
+        self._push_all.assert_called_once_with(
+            [crashdump.redact.__file__, mock.ANY], "/tmp/fake-uuid"
+        )
+        self.assertTrue(
+            self._run_all.call_args[0][0].endswith(
+                " | tar -pcf - --files-from - 2>/dev/null | python3 ../redact.py"
+                " ../redact.json > ../juju-dump-fake-uuid.tar"
+            )
+        )
+
+    def test_check_unit_space(self):
+        gib = 1024 * 1024
+        self.patch_target(
+            "_query_all",
+            {
+                "0": "1000\n/tmp %d\n/var/tmp %d\n/home/ubuntu\n" % (gib, gib),
+                "1": "%d\n/tmp 1000\n/var/tmp %d\n/home/ubuntu 0\n" % (gib, 2 * gib),
+                "2": "%d\n/tmp 1000\n/var/tmp 1000\n/home/ubuntu 0\n" % gib,
+                "3": "find: oops\n",
+            },
+        )
+        self.target.check_unit_space()
+        self.assertEqual(
+            self.target.dump_locations, {"0": "/tmp", "1": "/var/tmp", "2": None}
+        )
+
+    def test_create_unit_tarballs_fallback(self):
+        self.target.uniq = "fake-uuid"
+        self.target.dump_locations = {"0": "/tmp", "1": "/var/tmp", "2": None}
+        self.patch_target("_run_all")
+        self.patch_target("_run_each")
+        self.patch_target("get_all", {"0": [], "1": [], "2": [], "3": []})
+        self.target.create_unit_tarballs()
+        commands = self._run_each.call_args[0][0]
+        self.assertEqual(sorted(commands), ["0", "1", "3"])
+        self.assertEqual(commands["0"], commands["3"])
+        self.assertTrue(
+            commands["1"].startswith("mkdir -p /var/tmp/fake-uuid; mkdir -p /tmp/")
+        )
+        self.assertTrue(
+            commands["1"].endswith(
+                " | tar -pcf /var/tmp/fake-uuid/juju-dump-fake-uuid.tar"
+                " --files-from - 2>/dev/null"
+            )
+        )
+        self.assertIsNone(self.target.remote_tarball("2"))
+        self.assertTrue(
+            self.target.tar_cmd(None).endswith(" | tar -pcf - --files-from - 2>/dev/null")
+        )
+
+    def test_cleanup_units(self):
+        self.target.uniq = "fake-uuid"
+        self.target.dump_locations = {"0": "/tmp", "1": "/var/tmp", "2": None}
+        self.patch_target("_run_all")
+        self.target.cleanup_units()
+        self._run_all.assert_called_once_with("rm -rf /tmp/fake-uuid /var/tmp/fake-uuid")
+        self.target.as_root = True
+        self.target.cleanup_units()
+        self._run_all.assert_called_with(
+            "sudo rm -rf /tmp/fake-uuid /var/tmp/fake-uuid"
+        )
+
+    def test_write_report(self):
+        self.target.unreachable["1"] = 2
+        self.target.write_report(
+            {"0": "complete", "1": "complete", "2": "missing", "3": "partial"},
+            os.path.join(self.target.tardir, "report.yaml"),
+        )
+        with open(os.path.join(self.target.tardir, "report.yaml")) as fd:
+            report = crashdump.yaml.safe_load(fd)
+        self.assertEqual(report["complete"], ["0"])
+        self.assertEqual(report["partial"], ["1", "3"])
+        self.assertEqual(report["missing"], ["2"])
+        self.assertEqual(report["problems"]["1"], ["unreachable for 2 commands"])
+
+    def test_upload_parts(self):
+        self.target.uniq = "fake-uuid"
+        self.target.uploader = mock.Mock()
+        parts = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, parts)
+        self.target.uploader.part_path.side_effect = lambda name: os.path.join(
+            parts, name
+        )
+        for path in ("0/baremetal/var/log", "1/baremetal/var/log"):
+            os.makedirs(path)
+        with open("unit.tar", "w") as fd:
+            fd.write("tarball")
+        self.target.upload_part("0", "unit.tar")
+        self.target.uploader.submit.assert_called_once_with(
+            os.path.join(parts, "juju-crashdump-fake-uuid-0.tar"),
+            "juju-crashdump-fake-uuid-0.tar",
+            compress=True,
+        )
+        self.assertEqual(
+            self.target.parts, {"juju-crashdump-fake-uuid-0.tar.gz": "0/baremetal"}
+        )
+        self.target.upload_rest()
+        rest = os.path.join(parts, "juju-crashdump-fake-uuid-model.tar.xz")
+        self.target.uploader.submit.assert_called_with(
+            rest, "juju-crashdump-fake-uuid-model.tar.xz"
+        )
+        with crashdump.tarfile.open(rest) as tar:
+            names = tar.getnames()
+        top = os.path.basename(self.target.tardir)
+        self.assertIn(top + "/upload_parts.yaml", names)
+        self.assertIn(top + "/1/baremetal/var/log", names)
+        self.assertNotIn(top + "/0/baremetal", names)
+
+    def test_get_all_skip_machines(self):
+        status = {
+            "machines": {
+                "0": {
+                    "ip-addresses": ["10.0.0.1"],
+                    "containers": {"0/lxd/0": {"ip-addresses": ["10.0.0.2"]}},
+                },
+                "1": {"ip-addresses": ["10.0.0.3"]},
+            }
+        }
+        self.target.skip_machines = {"0/lxd/0", "1"}
+        with mock.patch.object(
+            crashdump.CrashCollector, "status", new_callable=mock.PropertyMock
+        ) as s, mock.patch.object(
+            crashdump.CrashCollector, "controller_status", new_callable=mock.PropertyMock
+        ) as c:
+            s.return_value = status
+            c.return_value = {}
+            self.assertEqual(self.target.get_all(), {"0": ["ubuntu@10.0.0.1"]})
+
+
+class TestRunCmd(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.to_file = os.path.join(self.path, "output.txt")
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_to_file(self):
+        self.assertTrue(crashdump.run_cmd("echo hello", to_file=self.to_file))
+        with open(self.to_file, "rb") as fd:
+            self.assertEqual(fd.read(), b"hello\n")
+        self.assertEqual(crashdump.CAPTURES[self.to_file]["bytes"], 6)
+
+    def test_to_file_compressed(self):
+        self.assertTrue(
+            crashdump.run_cmd("seq 100000", to_file=self.to_file, compress=True)
+        )
+        with gzip.open(self.to_file, "rb") as fd:
+            output = fd.read()
+        self.assertEqual(output.splitlines()[-1], b"100000")
+        self.assertEqual(crashdump.CAPTURES[self.to_file]["bytes"], len(output))
+
+    def test_to_file_failed(self):
+        self.assertFalse(crashdump.run_cmd("echo hello; false", to_file=self.to_file))
+        self.assertFalse(os.path.exists(self.to_file))
+
+
+class TestUnitTarballs(TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.path = tempfile.mkdtemp()
+        os.chdir(self.path)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.path)
+
+    def test_routes(self):
+        routes = crashdump.unit_tarball_routes("0", ["10.0.0.1"], None, "tar -cf -")
+        self.assertIn("ConnectTimeout", routes[0])
+        self.assertTrue(routes[1].startswith("juju ssh --pty=false --proxy 0 "))
+
+    def test_reached(self):
+        self.assertTrue(crashdump.reached("exit 1"))
+        self.assertFalse(crashdump.reached("exit 255"))
+        self.assertFalse(crashdump.reached("timeout 0.01s sleep 5"))
+
+    def test_fetch_next_route(self):
+        self.assertTrue(
+            crashdump.fetch_unit_tarball(
+                ["false", "echo fetched > {output}"],
+                "unit.tar",
+                crashdump.retry.Stragglers(),
+                poll=0.01,
+            )
+        )
+        with open("unit.tar") as fd:
+            self.assertEqual(fd.read(), "fetched\n")
+        self.assertEqual(os.listdir("."), ["unit.tar"])
+
+    def test_fetch_hedged(self):
+        stragglers = crashdump.retry.Stragglers(factor=2, min_samples=1, min_seconds=0)
+        stragglers.finished(0.01)
+        start = crashdump.time.time()
+        self.assertTrue(
+            crashdump.fetch_unit_tarball(
+                ["sleep 30; echo slow > {output}", "echo fast > {output}"],
+                "unit.tar",
+                stragglers,
+                poll=0.01,
+            )
+        )
+        self.assertLess(crashdump.time.time() - start, 10)
+        with open("unit.tar") as fd:
+            self.assertEqual(fd.read(), "fast\n")
+        self.assertEqual(os.listdir("."), ["unit.tar"])
+
+    def _tarball(self, size):
+        os.makedirs("src/var/log")
+        for name in ("a.log", "b.log"):
+            with open(os.path.join("src/var/log", name), "wb") as fd:
+                fd.write(b"x" * 10240)
+        crashdump.run_cmd("tar -cf unit.tar -C src var")
+        if size is not None:
+            with open("unit.tar", "r+b") as fd:
+                fd.truncate(size)
+
+    def test_extract_unit_tarball(self):
+        self._tarball(None)
+        self.assertEqual(
+            crashdump.extract_unit_tarball(("0", {"app/0"}, "unit.tar", False)),
+            ("0", "complete", None),
+        )
+        self.assertEqual(os.readlink("app_0"), "0/baremetal")
+        self.assertEqual(sorted(os.listdir("0/baremetal/var/log")), ["a.log", "b.log"])
+        self.assertFalse(os.path.exists("unit.tar"))
+
+    def test_extract_unit_tarball_partial(self):
+        # Cut off in the middle of the second file.
+        self._tarball(4 * 512 + 10240 + 4096)
+        self.assertEqual(
+            crashdump.extract_unit_tarball(("0", {"app/0"}, "unit.tar", True))[1],
+            "partial",
+        )
+        self.assertTrue(os.path.islink("app_0"))
+
+    def test_extract_unit_tarball_missing(self):
+        with open("unit.tar", "wb") as fd:
+            fd.write(b"not a tarball")
+        self.assertEqual(
+            crashdump.extract_unit_tarball(("0", {"app/0"}, "unit.tar", False))[1],
+            "missing",
+        )
+        self.assertFalse(os.path.lexists("app_0"))
+
+
+FAKE_KUBECTL = """#!/bin/sh
+case "$*" in
+    *"get pods -o json"*) cat "$(dirname "$0")/pods.json";;
+    *) echo "kubectl $*";;
+esac
+"""
+
+PODS = {
+    "items": [
+        {
+            "metadata": {"name": "app-0"},
+            "spec": {
+                "initContainers": [{"name": "charm-init"}],
+                "containers": [{"name": "charm"}, {"name": "app"}],
+            },
+            "status": {
+                "containerStatuses": [
+                    {"name": "charm", "restartCount": 0},
+                    {"name": "app", "restartCount": 2},
+                ]
+            },
+        }
+    ]
+}
+
+
+class TestCollectKubernetes(TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.path = tempfile.mkdtemp()
+        bin_dir = os.path.join(self.path, "bin")
+        os.mkdir(bin_dir)
+        with open(os.path.join(bin_dir, "kubectl"), "w") as fd:
+            fd.write(FAKE_KUBECTL)
+        os.chmod(os.path.join(bin_dir, "kubectl"), 0o755)
+        with open(os.path.join(bin_dir, "pods.json"), "w") as fd:
+            json.dump(PODS, fd)
+        self.dump = os.path.join(self.path, "dump")
+        os.mkdir(self.dump)
+        os.chdir(self.dump)
+        path = bin_dir + os.pathsep + os.environ["PATH"]
+        patcher = mock.patch.dict(os.environ, {"PATH": path})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.path)
+
+    def test_collect_kubernetes(self):
+        crashdump.collect_kubernetes("model", since="1h", jobs=2)
+        self.assertEqual(
+            sorted(os.listdir("kubernetes/app-0")),
+            [
+                "app.log",
+                "app.previous.log",
+                "charm-init.log",
+                "charm.log",
+                "describe.txt",
+            ],
+        )
+        with open("kubernetes/app-0/app.previous.log") as fd:
+            self.assertEqual(
+                fd.read(),
+                "kubectl -n model logs --timestamps --since=1h app-0 -c app "
+                "--previous\n",
+            )
+        with open("kubernetes/events.txt") as fd:
+            self.assertIn("get events", fd.read())
+
+    def test_collect_kubernetes_compressed(self):
+        crashdump.collect_kubernetes("model", jobs=2, compress=True)
+        self.assertIn("describe.txt", os.listdir("kubernetes/app-0"))
+        with gzip.open("kubernetes/app-0/app.log.gz", "rt") as fd:
+            self.assertEqual(fd.read(), "kubectl -n model logs --timestamps app-0 -c app\n")
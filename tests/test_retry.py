@@ -0,0 +1,57 @@
+# Copyright 2023 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+
+from unittest import TestCase
+
+import jujucrashdump.retry as retry
+
+
+class TestRetry(TestCase):
+    def test_delays(self):
+        delays = list(retry.RetryPolicy(5, 2.0, 5.0).delays())
+        self.assertEqual(len(delays), 4)
+        for delay, limit in zip(delays, [2.0, 4.0, 5.0, 5.0]):
+            self.assertTrue(limit / 2 <= delay <= limit)
+
+    @mock.patch.object(retry.time, "sleep")
+    def test_retry(self, sleep):
+        results = iter([False, False, "done"])
+        self.assertEqual(
+            retry.retry(lambda: next(results), retry.RetryPolicy(3)), "done"
+        )
+        self.assertEqual(sleep.call_count, 2)
+
+    @mock.patch.object(retry.time, "sleep")
+    def test_retry_budget(self, sleep):
+        budget = retry.ErrorBudget(3)
+        operation = mock.Mock(return_value=False)
+        policy = retry.RetryPolicy(3)
+        self.assertFalse(retry.retry(operation, policy, budget))
+        self.assertFalse(retry.retry(operation, policy, budget))
+        # 2 retries each, but only 3 in the budget.
+        self.assertEqual(operation.call_count, 5)
+        self.assertEqual(budget.spent, 3)
+
+    def test_stragglers(self):
+        stragglers = retry.Stragglers(factor=3, min_samples=3, min_seconds=10)
+        stragglers.finished(5)
+        stragglers.finished(6)
+        self.assertFalse(stragglers.is_straggler(100))
+        stragglers.finished(100)
+        self.assertEqual(stragglers.median(), 6)
+        self.assertFalse(stragglers.is_straggler(9))
+        self.assertFalse(stragglers.is_straggler(15))
+        self.assertTrue(stragglers.is_straggler(19))
@@ -0,0 +1,139 @@
+# Copyright 2023 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import mock
+
+from unittest import TestCase
+
+import jujucrashdump.archive as archive
+import jujucrashdump.search as search
+
+FILES = {
+    "uniq/juju_status.yaml": b"model: {}\n",
+    "uniq/debug_log.txt": b"machine-0: ERROR debug\n",
+    "uniq/0/baremetal/var/log/juju/machine-0.log": b"INFO fine\nERROR zero\n",
+    "uniq/0/lxd/1/var/log/juju/unit-app-0.log": b"ERROR app\n",
+    "uniq/0/lxd/1/var/log/syslog": b"ERROR syslog\n",
+    "uniq/10/baremetal/var/log/juju/unit-db-0.log": b"ERROR db\n",
+}
+
+
+class TestSearch(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        for path, data in FILES.items():
+            path = os.path.join(self.path, "dump", path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, "wb") as fd:
+                fd.write(data)
+        os.symlink("0/lxd/1", os.path.join(self.path, "dump", "uniq", "app_0"))
+        self.dump = os.path.join(self.path, "dump")
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_machine_groups(self):
+        entries = search.DirectorySource(self.dump).entries()
+        groups = search.machine_groups(entries)
+        self.assertEqual(
+            [(g, prefix) for g, prefix, _ in groups],
+            [
+                ("0/baremetal", "uniq/0/baremetal/"),
+                ("0/lxd/1", "uniq/0/lxd/1/"),
+                ("10/baremetal", "uniq/10/baremetal/"),
+                ("model", "uniq/"),
+            ],
+        )
+        self.assertEqual(
+            groups[3][2], ["uniq/debug_log.txt", "uniq/juju_status.yaml"]
+        )
+        groups = search.machine_groups(entries, machines=["10"], units=["app/0"])
+        self.assertEqual([g for g, _, _ in groups], ["0/lxd/1", "10/baremetal"])
+
+    def test_search(self):
+        results = list(
+            search.search(self.dump, "^ERROR", files=["var/log/juju/*"], jobs=2)
+        )
+        self.assertEqual(
+            results,
+            [
+                (
+                    "0/baremetal",
+                    [("uniq/0/baremetal/var/log/juju/machine-0.log", 2, b"ERROR zero\n")],
+                ),
+                (
+                    "0/lxd/1",
+                    [("uniq/0/lxd/1/var/log/juju/unit-app-0.log", 1, b"ERROR app\n")],
+                ),
+                (
+                    "10/baremetal",
+                    [("uniq/10/baremetal/var/log/juju/unit-db-0.log", 1, b"ERROR db\n")],
+                ),
+            ],
+        )
+
+    def test_search_archive(self):
+        path = os.path.join(self.path, "dump.jcd")
+        archive.write_archive(self.dump, path)
+        results = list(search.search(path, "error", units=["app/0"], ignore_case=True))
+        self.assertEqual(
+            [(group, [m[0] for m in matches]) for group, matches in results],
+            [
+                (
+                    "0/lxd/1",
+                    [
+                        "uniq/0/lxd/1/var/log/juju/unit-app-0.log",
+                        "uniq/0/lxd/1/var/log/syslog",
+                    ],
+                )
+            ],
+        )
+
+    def test_search_gzip(self):
+        # Like the debug-log fetched with --debug-log-jobs.
+        with gzip.open(os.path.join(self.dump, "uniq", "debug_log.txt.gz"), "wb") as fd:
+            fd.write(b"machine-1: INFO fine\nmachine-1: ERROR gzipped\n")
+        path = os.path.join(self.path, "dump.jcd")
+        archive.write_archive(self.dump, path)
+        for source in (self.dump, path):
+            results = list(search.search(source, "ERROR gz", files=["*.gz"], jobs=1))
+            self.assertEqual(
+                results,
+                [
+                    (
+                        "model",
+                        [("uniq/debug_log.txt.gz", 2, b"machine-1: ERROR gzipped\n")],
+                    )
+                ],
+            )
+
+    def test_main_errors(self):
+        tarball = os.path.join(self.path, "dump.tar.xz")
+        open(tarball, "wb").close()
+        for argv, error in [
+            (["foo", tarball], "extract it or collect it with --format indexed"),
+            (["(", self.dump], "invalid pattern '('"),
+        ]:
+            stderr = io.StringIO()
+            with mock.patch.object(archive.sys, "stderr", stderr):
+                with self.assertRaises(SystemExit) as cm:
+                    search.main(argv)
+            self.assertEqual(cm.exception.code, 1)
+            self.assertIn(error, stderr.getvalue())
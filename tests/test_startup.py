@@ -0,0 +1,90 @@
+# Copyright 2023 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from unittest import TestCase
+
+# Runs juju-crashdump with the given arguments, then reports on stderr
+# which of the modules and setup that should stay lazy were loaded.
+SCRIPT = """
+import sys
+import ssh_agent_setup
+ssh_agent_setup.setup = lambda: sys.stderr.write("ssh-agent\\n")
+from jujucrashdump import crashdump
+sys.argv = ["juju-crashdump"] + sys.argv[1:]
+try:
+    crashdump.main()
+except SystemExit:
+    pass
+for name in ("apport", "launchpadlib"):
+    if name in sys.modules:
+        sys.stderr.write(name + "\\n")
+"""
+# Generous, this guards against importing something slow at startup, not
+# against a slow machine.
+MAX_STARTUP = 2.0
+RUNS = 3
+
+
+class TestStartup(TestCase):
+    def setUp(self):
+        # Stand ins for apport and launchpadlib, so it can be seen whether
+        # they are imported.
+        self.path = tempfile.mkdtemp()
+        for name in ("apport", "launchpadlib"):
+            os.mkdir(os.path.join(self.path, name))
+            open(os.path.join(self.path, name, "__init__.py"), "w").close()
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.env = dict(
+            os.environ, PYTHONPATH=os.pathsep.join([self.path, root])
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _run(self, *args):
+        best = None
+        for _ in range(RUNS):
+            start = time.time()
+            proc = subprocess.run(
+                [sys.executable, "-c", SCRIPT] + list(args),
+                env=self.env,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                check=True,
+            )
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, proc.stderr.decode().split()
+
+    def test_help(self):
+        elapsed, loaded = self._run("--help")
+        self.assertEqual(loaded, [])
+        self.assertLess(elapsed, MAX_STARTUP)
+
+    def test_description(self):
+        elapsed, loaded = self._run("--description")
+        self.assertEqual(loaded, [])
+        self.assertLess(elapsed, MAX_STARTUP)
+
+    def test_subcommand(self):
+        elapsed, loaded = self._run("upload", "--help")
+        self.assertEqual(loaded, [])
+        self.assertLess(elapsed, MAX_STARTUP)
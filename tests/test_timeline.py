@@ -0,0 +1,108 @@
+# Copyright 2023 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import calendar
+import io
+import os
+import shutil
+import tempfile
+import mock
+
+from unittest import TestCase
+
+import jujucrashdump.timeline as timeline
+
+FILES = {
+    "uniq/juju_status.yaml": b"model: {}\n",
+    "uniq/debug_log.txt": b"machine-0: 2023-02-10 18:00:01 INFO juju.worker started\n",
+    "uniq/0/baremetal/var/log/juju/unit-app-0.log": (
+        b"2023-02-10 18:00:02 ERROR unit.app/0.install Traceback (most recent call last):\n"
+        b"  oops\n"
+        b"2023-02-10 18:00:05 INFO unit.app/0.install done\n"
+    ),
+    "uniq/0/baremetal/var/log/syslog": (
+        b"Feb 10 18:00:00 host systemd[1]: Started\n"
+        b"Feb 10 18:00:03 host kernel: python3 invoked oom-killer\n"
+    ),
+    "uniq/0/baremetal/etc/app.conf": b"2023-02-10 18:00:04 not a log\n",
+}
+
+
+class TestTimeline(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        mtime = calendar.timegm((2023, 2, 11, 0, 0, 0))
+        for path, data in FILES.items():
+            path = os.path.join(self.path, path)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, "wb") as fd:
+                fd.write(data)
+            os.utime(path, (mtime, mtime))
+        self.output = os.path.join(self.path, "timeline.txt")
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_timestamp(self):
+        self.assertEqual(
+            timeline.timestamp(b"2023-02-10T18:00:00.123+00:00 host x", 2000),
+            "2023-02-10 18:00:00",
+        )
+        self.assertEqual(
+            timeline.timestamp(b"Feb  1 18:00:00 host x", 2023), "2023-02-01 18:00:00"
+        )
+        self.assertIsNone(timeline.timestamp(b"  File 'x.py', line 1", 2023))
+
+    def _read(self):
+        with open(self.output, "rb") as fd:
+            return fd.read().splitlines()
+
+    def test_write_timeline(self):
+        timeline.write_timeline(self.path, self.output)
+        self.assertEqual(
+            self._read(),
+            [
+                b"0/baremetal:var/log/syslog | Feb 10 18:00:00 host systemd[1]: Started",
+                b"model:debug_log.txt | machine-0: 2023-02-10 18:00:01 INFO juju.worker started",
+                b"0/baremetal:var/log/juju/unit-app-0.log | 2023-02-10 18:00:02 ERROR "
+                b"unit.app/0.install Traceback (most recent call last):",
+                b"0/baremetal:var/log/juju/unit-app-0.log |   oops",
+                b"0/baremetal:var/log/syslog | Feb 10 18:00:03 host kernel: python3 invoked "
+                b"oom-killer",
+                b"0/baremetal:var/log/juju/unit-app-0.log | 2023-02-10 18:00:05 INFO "
+                b"unit.app/0.install done",
+            ],
+        )
+
+    def test_write_timeline_window(self):
+        timeline.write_timeline(
+            self.path, self.output, "2023-02-10 18:00:02", "2023-02-10 18:00:03"
+        )
+        self.assertEqual(len(self._read()), 3)
+
+    def test_write_timeline_batches(self):
+        with mock.patch.object(timeline, "MAX_OPEN", 2):
+            timeline.write_timeline(self.path, self.output)
+        self.assertEqual(len(self._read()), 6)
+
+    def test_main_not_a_directory(self):
+        missing = os.path.join(self.path, "missing")
+        stderr = io.StringIO()
+        with mock.patch.object(timeline.archive.sys, "stderr", stderr):
+            with self.assertRaises(SystemExit) as cm:
+                timeline.main([missing, "-o", self.output])
+        self.assertEqual(cm.exception.code, 1)
+        self.assertIn("is not a crashdump directory", stderr.getvalue())
+        self.assertFalse(os.path.exists(self.output))
@@ -0,0 +1,144 @@
+# Copyright 2023 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import yaml
+
+from unittest import TestCase
+
+import jujucrashdump.triage as triage
+
+UNIT_LOG = (
+    b"2023-02-10 18:16:06 INFO juju.worker.uniter.operation ran install\n"
+    b'2023-02-10 18:16:07 ERROR juju.worker.uniter.operation runhook.go:153 hook "config-changed"'
+    b" (via explicit, bespoke hook script) failed: exit status 1\n"
+    b"2023-02-10 18:16:07 WARNING unit.app/0.config-changed Traceback (most recent call last):\n"
+)
+KERN_LOG = b"Feb 10 18:20:00 host kernel: [1.0] python3 invoked oom-killer: gfp_mask=0x0\n"
+MONGO_LOG = b'{"t":{"$date":"2023-02-10"},"s":"E","c":"REPL","msg":"oops"}\n'
+
+
+class TestTriage(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_scanner_chunks(self):
+        findings = triage.Triage()
+        scanner = findings.scanner("0/baremetal/var/log/juju/unit-app-0.log")
+        for i in range(0, len(UNIT_LOG), 7):
+            scanner.feed(UNIT_LOG[i:i + 7])
+        scanner.close()
+        self.assertEqual(findings.counts["failed-hooks"], 1)
+        self.assertEqual(findings.findings["failed-hooks"][0]["line"], 2)
+        self.assertEqual(findings.findings["tracebacks"][0]["line"], 3)
+
+    def _tarball(self, files):
+        tarball = os.path.join(self.path, "unit.tar")
+        with tarfile.open(tarball, "w") as tar:
+            for name, data in files.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        return tarball
+
+    def test_extract_and_scan(self):
+        tarball = self._tarball(
+            {
+                "var/log/juju/unit-app-0.log": UNIT_LOG,
+                "var/log/kern.log": KERN_LOG,
+                "var/snap/juju-db/common/logs/mongodb.log": MONGO_LOG,
+                # Not a log, so it is extracted but not scanned.
+                "etc/app/app.conf": UNIT_LOG,
+            }
+        )
+        dest = os.path.join(self.path, "0", "baremetal")
+        os.makedirs(dest)
+        findings = triage.extract_and_scan(tarball, dest, "0/baremetal")
+        with open(os.path.join(dest, "var/log/juju/unit-app-0.log"), "rb") as fd:
+            self.assertEqual(fd.read(), UNIT_LOG)
+        self.assertTrue(os.path.exists(os.path.join(dest, "etc/app/app.conf")))
+        self.assertEqual(
+            findings.counts,
+            {"failed-hooks": 1, "tracebacks": 1, "oom-kills": 1, "juju-db-errors": 1},
+        )
+        self.assertEqual(
+            findings.findings["oom-kills"][0]["file"], "0/baremetal/var/log/kern.log"
+        )
+
+    def test_extract_and_scan_addon_output(self):
+        # As created by tar_cmd: the find in the addon output directory lists
+        # the system directories by absolute path and the addon output as ./
+        tarball = self._tarball(
+            {
+                "var/log/syslog": b"fine\n",
+                "./journalctl/jujud-machine-0.log": KERN_LOG,
+                "./juju_introspection/juju_engine_report.txt": UNIT_LOG,
+                # Addon output that isn't a log, not scanned.
+                "./psaux.txt": KERN_LOG,
+            }
+        )
+        dest = os.path.join(self.path, "0", "baremetal")
+        os.makedirs(dest)
+        findings = triage.extract_and_scan(tarball, dest, "0/baremetal")
+        self.assertTrue(os.path.exists(os.path.join(dest, "psaux.txt")))
+        self.assertEqual(
+            findings.counts,
+            {"failed-hooks": 1, "tracebacks": 1, "oom-kills": 1, "juju-db-errors": 0},
+        )
+        self.assertEqual(
+            findings.findings["oom-kills"][0]["file"],
+            "0/baremetal/journalctl/jujud-machine-0.log",
+        )
+
+    def test_write_summary(self):
+        status = {
+            "machines": {"0": {"juju-status": {"current": "started"}}},
+            "applications": {
+                "app": {
+                    "units": {
+                        "app/0": {
+                            "workload-status": {
+                                "current": "blocked",
+                                "message": "missing relation",
+                            }
+                        },
+                        "app/1": {"workload-status": {"current": "active"}},
+                    }
+                }
+            },
+        }
+        findings = triage.Triage()
+        scanner = findings.scanner("0/baremetal/var/log/kern.log")
+        scanner.feed(KERN_LOG * (triage.MAX_FINDINGS + 2))
+        scanner.close()
+        triage.write_summary(status, findings, self.path)
+        with open(os.path.join(self.path, "summary.yaml")) as fd:
+            summary = yaml.safe_load(fd)
+        self.assertEqual(
+            summary["status"],
+            [{"unit": "app/0", "status": "blocked", "message": "missing relation"}],
+        )
+        self.assertEqual(summary["oom-kills"]["count"], triage.MAX_FINDINGS + 2)
+        self.assertEqual(len(summary["oom-kills"]["found"]), triage.MAX_FINDINGS)
+        with open(os.path.join(self.path, "summary.txt")) as fd:
+            text = fd.read()
+        self.assertIn("  app/0: blocked missing relation\n", text)
+        self.assertIn("  ... and 2 more\n", text)
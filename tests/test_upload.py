@@ -0,0 +1,273 @@
+# Copyright 2023 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import types
+import mock
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase
+
+import jujucrashdump.upload as upload
+
+CHUNK = 1000
+DATA = os.urandom(CHUNK * 5 + 123)
+
+
+class FailingBackend(upload.DirectoryBackend):
+    def __init__(self, path, fail):
+        super(FailingBackend, self).__init__(path)
+        self.fail = fail
+        self.puts = []
+
+    def put_chunk(self, upload_id, index, data):
+        self.puts.append(index)
+        if index in self.fail:
+            raise IOError("connection reset")
+        super(FailingBackend, self).put_chunk(upload_id, index, data)
+
+
+class FakeHTTPError(Exception):
+    # Like lazr.restfulclient.errors.HTTPError.
+    def __init__(self, status):
+        super(FakeHTTPError, self).__init__(status)
+        self.response = mock.Mock(status=status, reason="Reason")
+
+
+class ChunkHandler(BaseHTTPRequestHandler):
+    # {name: {index: data}}, and {name: manifest} once complete.
+    chunks = {}
+    complete = {}
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, code, body=b""):
+        self.send_response(code)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        name = self.path.strip("/")
+        if name not in self.chunks:
+            return self._reply(404)
+        self._reply(200, json.dumps(sorted(self.chunks[name])).encode())
+
+    def do_PUT(self):
+        name, index = self.path.strip("/").rsplit("/", 1)
+        data = self.rfile.read(int(self.headers["Content-Length"]))
+        self.chunks.setdefault(name, {})[int(index)] = data
+        self._reply(200)
+
+    def do_POST(self):
+        name = self.path.strip("/").rsplit("/", 1)[0]
+        length = int(self.headers["Content-Length"])
+        self.complete[name] = json.loads(self.rfile.read(length).decode())
+        self._reply(200)
+
+
+class TestUpload(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.file = os.path.join(self.path, "dump.tar.xz")
+        with open(self.file, "wb") as fd:
+            fd.write(DATA)
+        self.dest = os.path.join(self.path, "dest")
+        os.mkdir(self.dest)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _uploaded(self, name="dump.tar.xz"):
+        with open(os.path.join(self.dest, name), "rb") as fd:
+            return fd.read()
+
+    def test_missing_file(self):
+        missing = os.path.join(self.path, "missing.tar.xz")
+        with self.assertRaises(upload.UploadError):
+            upload.upload(missing, upload.DirectoryBackend(self.dest))
+        # Nothing was started on the backend.
+        self.assertEqual(os.listdir(self.dest), [])
+
+    def test_manifest(self):
+        info = upload.manifest(self.file, "dump", CHUNK)
+        self.assertEqual(info["size"], len(DATA))
+        self.assertEqual(len(info["chunks"]), 6)
+
+    def test_directory(self):
+        location = upload.upload(
+            self.file, upload.DirectoryBackend(self.dest), chunk_size=CHUNK, jobs=3
+        )
+        self.assertEqual(location, os.path.join(self.dest, "dump.tar.xz"))
+        self.assertEqual(self._uploaded(), DATA)
+        self.assertEqual(os.listdir(self.dest), ["dump.tar.xz"])
+        self.assertFalse(os.path.exists(self.file + upload.STATE_SUFFIX))
+
+    @mock.patch.object(upload.retry.time, "sleep")
+    def test_resume(self, sleep):
+        backend = FailingBackend(self.dest, fail={2, 4})
+        with self.assertRaises(upload.UploadError):
+            upload.upload(self.file, backend, chunk_size=CHUNK)
+        self.assertTrue(os.path.exists(self.file + upload.STATE_SUFFIX))
+        backend = FailingBackend(self.dest, fail=set())
+        upload.upload(self.file, backend, chunk_size=CHUNK)
+        self.assertEqual(sorted(backend.puts), [2, 4])
+        self.assertEqual(self._uploaded(), DATA)
+
+    def test_changed_file_restarts(self):
+        backend = FailingBackend(self.dest, fail=set(range(6)))
+        with mock.patch.object(upload.retry, "TRANSFER", upload.retry.RetryPolicy(1)):
+            with self.assertRaises(upload.UploadError):
+                upload.upload(self.file, backend, chunk_size=CHUNK)
+        with open(self.file, "ab") as fd:
+            fd.write(b"more")
+        backend = FailingBackend(self.dest, fail=set())
+        upload.upload(self.file, backend, chunk_size=CHUNK)
+        self.assertEqual(sorted(backend.puts), list(range(6)))
+        self.assertEqual(self._uploaded(), DATA + b"more")
+
+    def test_http(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), ChunkHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            url = "http://127.0.0.1:%d/dumps" % server.server_address[1]
+            backend = upload.HTTPBackend(url)
+            self.assertEqual(backend.uploaded("dump.tar.xz"), set())
+            upload.upload(self.file, backend, chunk_size=CHUNK)
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+        chunks = ChunkHandler.chunks["dumps/dump.tar.xz"]
+        self.assertEqual(b"".join(chunks[i] for i in sorted(chunks)), DATA)
+        self.assertEqual(
+            ChunkHandler.complete["dumps/dump.tar.xz"]["sha256"],
+            upload.manifest(self.file, "dump.tar.xz", CHUNK)["sha256"],
+        )
+
+    def test_uploader(self):
+        uploader = upload.Uploader(
+            upload.DirectoryBackend(self.dest), jobs=2, chunk_size=CHUNK
+        )
+        part = uploader.part_path("0.tar")
+        shutil.copyfile(self.file, part)
+        uploader.submit(part, compress=True)
+        uploader.submit(self.file)
+        self.assertEqual(uploader.wait(), [])
+        with gzip.open(os.path.join(self.dest, "0.tar.gz"), "rb") as fd:
+            self.assertEqual(fd.read(), DATA)
+        self.assertEqual(self._uploaded(), DATA)
+        self.assertFalse(os.path.exists(uploader.staging))
+        self.assertTrue(os.path.exists(self.file))
+
+    @mock.patch.object(upload.retry.time, "sleep")
+    def test_uploader_resume(self, sleep):
+        keep = os.path.join(self.path, "keep")
+        os.mkdir(keep)
+        uploader = upload.Uploader(
+            FailingBackend(self.dest, fail={2, 4}), chunk_size=CHUNK, keep_dir=keep
+        )
+        part = uploader.part_path("0.tar")
+        shutil.copyfile(self.file, part)
+        uploader.submit(part)
+        # The part and its state are kept out of the staging directory.
+        kept = os.path.join(keep, "0.tar")
+        self.assertEqual(uploader.wait(), [kept])
+        self.assertFalse(os.path.exists(uploader.staging))
+        self.assertTrue(os.path.exists(kept + upload.STATE_SUFFIX))
+        backend = FailingBackend(self.dest, fail=set())
+        upload.upload(kept, backend, chunk_size=CHUNK)
+        self.assertEqual(sorted(backend.puts), [2, 4])
+        self.assertEqual(self._uploaded("0.tar"), DATA)
+
+
+class TestLaunchpadBackend(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.file = os.path.join(self.path, "dump.tar.xz")
+        with open(self.file, "wb") as fd:
+            fd.write(DATA)
+        self.bug = mock.Mock(
+            duplicate_of=None, attachments=[], owner_link="me", subscriptions=[]
+        )
+        launchpad = mock.Mock()
+        launchpad.me.self_link = "me"
+        launchpad.bugs.__getitem__ = mock.Mock(return_value=self.bug)
+        modules = {
+            "lazr": types.ModuleType("lazr"),
+            "lazr.restfulclient": types.ModuleType("lazr.restfulclient"),
+            "lazr.restfulclient.errors": mock.Mock(HTTPError=FakeHTTPError),
+            "launchpadlib": types.ModuleType("launchpadlib"),
+            "launchpadlib.launchpad": mock.Mock(),
+        }
+        self.login_with = modules["launchpadlib.launchpad"].Launchpad.login_with
+        self.login_with.return_value = launchpad
+        self.credentials = os.path.join(self.path, "lp", "credentials")
+        for patcher in (
+            mock.patch.dict(sys.modules, modules),
+            mock.patch.object(upload, "CREDENTIALS_FILE", self.credentials),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    @mock.patch.object(upload.retry.time, "sleep")
+    def test_server_error_retried(self, sleep):
+        errors = [FakeHTTPError(503)]
+
+        def attach(**kwargs):
+            if errors:
+                raise errors.pop()
+
+        self.bug.addAttachment.side_effect = attach
+        location = upload.upload(
+            self.file, upload.LaunchpadBackend("1234"), chunk_size=CHUNK
+        )
+        self.assertEqual(location, "lp:1234")
+        self.assertEqual(self.bug.addAttachment.call_count, 7)
+        # Only the one message putting the parts together comments.
+        self.assertEqual(
+            set(c[1]["comment"] for c in self.bug.addAttachment.call_args_list), {""}
+        )
+        self.assertEqual(self.bug.newMessage.call_count, 1)
+        # Every thread uses the saved credentials.
+        for call in self.login_with.call_args_list:
+            self.assertEqual(call[1]["credentials_file"], self.credentials)
+        self.assertTrue(os.path.isdir(os.path.dirname(self.credentials)))
+
+    @mock.patch.object(upload, "manifest")
+    def test_not_subscribed(self, manifest):
+        self.bug.owner_link = "someone"
+        self.bug.subscriptions = [mock.Mock(person_link="someone else")]
+        with self.assertRaises(upload.UploadError):
+            upload.upload(self.file, upload.LaunchpadBackend("1234"), chunk_size=CHUNK)
+        # Refused before the file is hashed.
+        self.assertFalse(manifest.called)
+
+    def test_refused(self):
+        self.bug.addAttachment.side_effect = FakeHTTPError(403)
+        with self.assertRaises(SystemExit) as cm:
+            upload.main([self.file, "--bug", "1234", "--chunk-size", str(CHUNK)])
+        self.assertEqual(cm.exception.code, 1)
+        self.assertTrue(os.path.exists(self.file + upload.STATE_SUFFIX))